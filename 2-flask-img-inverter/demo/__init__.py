@@ -13,4 +13,8 @@ from .potrace import (
     POTRACE_TURNPOLICY_RIGHT,
     POTRACE_TURNPOLICY_LEFT,
     POTRACE_TURNPOLICY_RANDOM,
+    TraceBudget,
+    trace_levels,
+    use_jit,
 )
+from .trace_stats import TraceObserver, TraceStats
@@ -6,7 +6,10 @@ import os
 import open3d as o3d
 import subprocess
 from werkzeug.utils import secure_filename
-from potrace.potrace import Bitmap, POTRACE_TURNPOLICY_MINORITY
+from potrace.potrace import Bitmap, POTRACE_CORNER, POTRACE_TURNPOLICY_MINORITY, TraceBudget, trace_levels, use_jit
+from potrace.trace_cache import TraceCache
+from potrace.retrace import Retracer
+from potrace.trace_stats import TraceStats
 from flask import send_from_directory
 
 app = Flask(__name__)
@@ -19,6 +22,55 @@ logger = logging.getLogger(__name__)
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Compile the potrace kernels now rather than during the first request;
+# numba logs its compiler passes at DEBUG, which would flood the log
+logging.getLogger('numba').setLevel(logging.WARNING)
+if use_jit():
+    logger.info('potrace: using the compiled kernels')
+else:
+    logger.info('potrace: numba is not installed, tracing in pure Python')
+
+# Traces of images already converted, in memory and under uploads/
+trace_cache = TraceCache(os.path.join(UPLOAD_FOLDER, 'trace-cache'))
+
+# Stage times and path sizes of all traces since start, served at /trace-metrics
+trace_metrics = TraceStats()
+
+# Seconds a trace may take before the paths not yet fitted are returned
+# as plain polygons, so that one pathological upload cannot hold a worker
+TRACE_SECONDS = 20
+
+# Most gray levels a posterized SVG may ask for, and the processes its
+# levels are traced in side by side
+MAX_LEVELS = 16
+TRACE_WORKERS = os.cpu_count() or 1
+
+# The last trace of each upload name, so that re-posting an edited image
+# only re-processes the paths the edit changed
+MAX_RETRACERS = 32
+retracers = {}
+
+def retracer_for(input_file_path):
+    name = os.path.basename(input_file_path)
+    retracer = retracers.pop(name, None)
+    if retracer is None:
+        retracer = Retracer()
+        if len(retracers) >= MAX_RETRACERS:
+            retracers.pop(next(iter(retracers)))
+    retracers[name] = retracer
+    return retracer
+
+def curve_to_svg_path(tags, c):
+    x, y = c[-1, 2].tolist()
+    parts = [f"M{x},{y}"]
+    for tag, ((ax, ay), (bx, by), (cx, cy)) in zip(tags.tolist(), c.tolist()):
+        if tag == POTRACE_CORNER:
+            parts.append(f"L{bx},{by}L{cx},{cy}")
+        else:
+            parts.append(f"C{ax},{ay} {bx},{by} {cx},{cy}")
+    parts.append("z")
+    return "".join(parts)
+
 def file_to_svg(input_file_path):
     try:
         image = Image.open(input_file_path)
@@ -26,32 +78,89 @@ def file_to_svg(input_file_path):
         logger.error(f"Image ({input_file_path}) could not be loaded.")
         return None
     bm = Bitmap(image, blacklevel=0.5)
-    plist = bm.trace(
+    stats = TraceStats()
+    result = trace_cache.trace(
+        bm,
+        tracer=retracer_for(input_file_path).trace,
+        observer=stats,
+        budget=TraceBudget(TRACE_SECONDS),
         turdsize=2,
         turnpolicy=POTRACE_TURNPOLICY_MINORITY,
         alphamax=1,
         opticurve=False,
         opttolerance=0.2,
     )
+    if result.get("partial"):
+        logger.warning(f"Trace of {input_file_path} ran out of time after {TRACE_SECONDS}s, some curves are polygons")
+    if stats.stages:
+        logger.info(f"Traced {input_file_path}: {stats}")
+        trace_metrics.merge(stats)
+    else:
+        logger.info(f"Trace of {input_file_path} found in the cache")
     svg_output = f"{input_file_path}.svg"
     with open(svg_output, "w") as fp:
         fp.write(f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="{image.width}" height="{image.height}" viewBox="0 0 {image.width} {image.height}">')
-        parts = []
-        for curve in plist:
-            fs = curve.start_point
-            parts.append(f"M{fs.x},{fs.y}")
-            for segment in curve.segments:
-                if segment.is_corner:
-                    a = segment.c
-                    b = segment.end_point
-                    parts.append(f"L{a.x},{a.y}L{b.x},{b.y}")
-                else:
-                    a = segment.c1
-                    b = segment.c2
-                    c = segment.end_point
-                    parts.append(f"C{a.x},{a.y} {b.x},{b.y} {c.x},{c.y}")
-            parts.append("z")
-        fp.write(f'<path stroke="none" fill="black" fill-rule="evenodd" d="{"".join(parts)}"/>')
+        fp.write('<g stroke="none" fill="black" fill-rule="evenodd">')
+        write_svg_paths(fp, result)
+        fp.write("</g>")
+        fp.write("</svg>")
+    return svg_output
+
+def write_svg_paths(fp, result):
+    # One <path> per shape: a top-level curve (or a curve inside a hole)
+    # together with its holes.
+    tags, c, offsets, parent = (result[k] for k in ("tags", "c", "offsets", "parent"))
+    children = [[] for _ in range(len(parent))]
+    for i, p in enumerate(parent.tolist()):
+        if p >= 0:
+            children[p].append(i)
+
+    def svg_path(i):
+        a, b = offsets[i], offsets[i + 1]
+        return curve_to_svg_path(tags[a:b], c[a:b])
+
+    shapes = np.flatnonzero(parent < 0).tolist()
+    while shapes:
+        i = shapes.pop(0)
+        parts = [svg_path(i)]
+        for hole in children[i]:
+            parts.append(svg_path(hole))
+            shapes.extend(children[hole])
+        fp.write(f'<path d="{"".join(parts)}"/>')
+
+def file_to_layered_svg(input_file_path, levels):
+    """Posterize into the given number of gray levels, one <path> per level."""
+    try:
+        image = Image.open(input_file_path)
+    except IOError:
+        logger.error(f"Image ({input_file_path}) could not be loaded.")
+        return None
+    blacklevels = [(k + 1) / (levels + 1) for k in range(levels)]
+    plists = trace_levels(
+        Bitmap.levels(image, blacklevels),
+        turdsize=2,
+        turnpolicy=POTRACE_TURNPOLICY_MINORITY,
+        alphamax=1,
+        opticurve=False,
+        opttolerance=0.2,
+        workers=min(levels, TRACE_WORKERS),
+        budget=TraceBudget(TRACE_SECONDS),
+    )
+    if any(plist.partial for plist in plists):
+        logger.warning(f"Trace of {input_file_path} ran out of time after {TRACE_SECONDS}s, some curves are polygons")
+    svg_output = f"{input_file_path}.svg"
+    with open(svg_output, "w") as fp:
+        fp.write(f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="{image.width}" height="{image.height}" viewBox="0 0 {image.width} {image.height}">')
+        # Lightest level first: each darker level is painted over the
+        # lighter ones, in the gray of the level above its pixels.
+        for k in reversed(range(levels)):
+            gray = round(255 * blacklevels[k - 1]) if k > 0 else 0
+            tags, c, offsets = plists[k].to_numpy()
+            d = "".join(
+                curve_to_svg_path(tags[a:b], c[a:b])
+                for a, b in zip(offsets[:-1], offsets[1:])
+            )
+            fp.write(f'<path stroke="none" fill="rgb({gray},{gray},{gray})" fill-rule="evenodd" d="{d}"/>')
         fp.write("</svg>")
     return svg_output
 
@@ -270,6 +379,10 @@ def save_as_obj():
             logger.error(f'Blender script failed: {e}')
             return jsonify({'message': f'Blender script failed: {e}'}), 500
         
+@app.route('/trace-metrics')
+def get_trace_metrics():
+    return jsonify(trace_metrics.as_dict())
+
 @app.route('/save-as-svg', methods=['POST'])
 def save_as_svg():
     if 'image' not in request.files:
@@ -281,12 +394,20 @@ def save_as_svg():
     if filename == '':
         return jsonify({'message': 'Invalid file name'}), 400
     
+    # Every level is a full-size bitmap traced on its own, so keep it small
+    levels = request.form.get('levels', 1, type=int)
+    if not 1 <= levels <= MAX_LEVELS:
+        return jsonify({'message': f'levels must be between 1 and {MAX_LEVELS}'}), 400
+
     # Save the original image temporarily
     temp_image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     image.save(temp_image_path)
     
-    # Convert the saved image to SVG
-    svg_filename = file_to_svg(temp_image_path)
+    # Convert the saved image to SVG, posterized if several levels are asked for
+    if levels > 1:
+        svg_filename = file_to_layered_svg(temp_image_path, levels)
+    else:
+        svg_filename = file_to_svg(temp_image_path)
     
     # Clean up the original image file to save space, if desired
     os.remove(temp_image_path)
@@ -2,8 +2,14 @@
 LIBRARY OBTAINED FROM POTRACER, A PYTHON PORT FOR POTRACE: https://pypi.org/project/potracer/
 """
 
+import copy
+import itertools
 import math
-from typing import Optional, Tuple, Union
+import os
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Optional, Tuple
 
 import numpy as np
 
@@ -22,23 +28,177 @@ POTRACE_CORNER = 2
 INFTY = float("inf")
 COS179 = math.cos(math.radians(179))
 
+_jit = None  # /* the potrace_jit module, while its kernels are in use */
+
+
+def use_jit(enable: bool = True) -> bool:
+    """
+    Run findpath, _calc_lon and _bestpolygon as the compiled kernels of
+    potrace_jit if numba is installed, compiling them right away, or go
+    back to the pure Python code with enable=False. Returns whether the
+    kernels are in use. Pool workers started with the "fork" method
+    inherit the setting.
+    """
+    global _jit
+    _jit = None
+    if enable:
+        from . import potrace_jit
+
+        if potrace_jit.AVAILABLE:
+            potrace_jit.warm_up()
+            _jit = potrace_jit
+    return _jit is not None
+
+
+class TraceBudget:
+    """
+    Time limit and cancellation token of a trace. The trace checks it
+    between paths and between stages; once seconds have passed since the
+    budget was made, or cancel() was called (e.g. from another thread),
+    it stops and returns what it has: see Bitmap.trace. It stops early
+    enough to degrade the paths found and build the result before the
+    deadline, going by RESERVE_PER_POINT, which is on the safe side for
+    a slow machine. A stage that is already running on a batch of paths
+    is not interrupted.
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.cancelled = False
+        self.exhausted = False  # /* a trace skipped work because of it */
+        self._parent = None  # /* the budget this one is a part of, see _split_budget */
+        self._per_point = RESERVE_PER_POINT  # /* see _out_of_budget */
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def expired(self, reserve: float = 0.0) -> bool:
+        """whether it ran out, keeping reserve seconds for the caller"""
+        return (
+            self.cancelled
+            or (self._parent is not None and self._parent.cancelled)
+            or (
+                self.deadline is not None
+                and time.monotonic() + reserve >= self.deadline
+            )
+        )
+
+
+# /* seconds kept per point of the paths found for degrading them and
+#    building the result once the budget runs out (see _degrade_paths) */
+RESERVE_PER_POINT = 5e-6
+
+
+def _as_budget(budget) -> Optional[TraceBudget]:
+    """budget given as a TraceBudget, a number of seconds or None"""
+    if budget is None or isinstance(budget, TraceBudget):
+        return budget
+    return TraceBudget(budget)
+
+
+def _split_budget(budget: Optional[TraceBudget], rounds: int) -> list:
+    """
+    budgets for rounds of work done one after another, each ending an
+    equal part of the time left before the deadline of budget later
+    than the one before, so a round that finishes early leaves its time
+    to the rest. They are cancelled along with budget.
+    """
+    if budget is None or budget.deadline is None:
+        return [budget] * rounds
+    now = time.monotonic()
+    left = max(budget.deadline - now, 0.0)
+    parts = []
+    for r in range(1, rounds + 1):
+        part = TraceBudget()
+        part.deadline = now + left * r / rounds
+        part._parent = budget
+        part._per_point = budget._per_point
+        parts.append(part)
+    return parts
+
+
+def _out_of_budget(budget: Optional[TraceBudget], points: int = 0) -> bool:
+    """
+    whether the work about to be done must be skipped, so that the paths
+    of that many points already found can still be returned in time
+    """
+    if budget is not None and budget.expired(points * budget._per_point):
+        budget.exhausted = True
+        return True
+    return False
+
+
+def _pool_size(workers: Optional[int]) -> int:
+    """
+    workers capped at the number of CPUs: more processes than that only
+    take turns on them, and each would measure its part of a budget
+    against a clock that runs while the others have the CPU.
+    """
+    return min(workers or 1, os.cpu_count() or 1)
+
+
+def _decode(data, size: Optional[Tuple[int, int]] = None) -> Tuple[np.ndarray, bool]:
+    """
+    the pixels of a Bitmap source as an array, and whether they are the
+    gray levels of a PIL image
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        if size is None:
+            raise ValueError("size=(width, height) is required for raw buffers")
+        w, h = size
+        return np.frombuffer(data, dtype=np.uint8, count=w * h).reshape(h, w), False
+    if hasattr(data, "mode"):
+        if data.mode != "L":
+            data = data.convert("L")
+        return np.asarray(data), True
+    return np.asarray(data), False
+
 
 class Bitmap:
-    def __init__(self, data, blacklevel=0.5):
-        if hasattr(data, "dtype"):
-            if data.dtype != "bool":
-                data = data > (255 * blacklevel)
-        if hasattr(data, "mode"):
-            if data.mode != "L":
-                data = data.convert("L")
-            data = data.point(lambda e: 0 if (e / 255.0) < blacklevel else 255)
-            image = data.convert("1")
-            data = np.array(image)
-        self.data = data
-        self.invert()
+    def __init__(self, data, blacklevel=0.5, size: Optional[Tuple[int, int]] = None):
+        """
+        data is a PIL image, a numpy array (bool, or levels compared
+        against 255 * blacklevel) or, given size=(width, height), a bytes
+        or memoryview buffer of 8-bit gray levels. Arrays and buffers are
+        read in place. Black pixels become True in self.data, which is a
+        view into a buffer with the clear row and column bm_to_pathlist
+        expects, so trace does not need to pad a copy.
+        """
+        self._threshold(*_decode(data, size), blacklevel)
+
+    @classmethod
+    def levels(
+        cls, data, blacklevels, size: Optional[Tuple[int, int]] = None
+    ) -> list:
+        """
+        One Bitmap per black level, from a single decode of data (see
+        __init__), e.g. for trace_levels.
+        """
+        source = _decode(data, size)
+        bitmaps = []
+        for blacklevel in blacklevels:
+            bm = cls.__new__(cls)
+            bm._threshold(*source, blacklevel)
+            bitmaps.append(bm)
+        return bitmaps
+
+    def _threshold(self, data: np.ndarray, image: bool, blacklevel):
+        self._alloc(*data.shape)
+        if image:
+            # /* levels below blacklevel are black, as with point() and convert("1") */
+            lut = (np.arange(256) / 255.0) < blacklevel
+            np.take(lut, data, out=self.data)
+        elif data.dtype == bool:
+            np.invert(data, out=self.data)
+        else:
+            np.less_equal(data, 255 * blacklevel, out=self.data)
+
+    def _alloc(self, h: int, w: int):
+        self._buffer = np.zeros((h + 1, w + 1), dtype=bool)
+        self.data = self._buffer[:h, :w]
 
     def invert(self):
-        self.data = np.invert(self.data)
+        np.invert(self.data, out=self.data)
 
     def trace(
         self,
@@ -47,23 +207,152 @@ class Bitmap:
         alphamax=1.0,
         opticurve=True,
         opttolerance=0.2,
+        backend: str = "dense",
+        workers: Optional[int] = None,
+        tilesize: Optional[int] = None,
+        observer=None,
+        budget=None,
     ):
-        bm = np.pad(self.data, [(0, 1), (0, 1)], mode="constant")
-
-        plist = bm_to_pathlist(bm, turdsize=turdsize, turnpolicy=turnpolicy)
+        """
+        backend selects the bitmap representation used during path
+        decomposition: "dense" (one bool per pixel), "packed" (8 pixels
+        per byte, for very large scans) or "rle" (runs of set pixels, for
+        mostly white scans such as line art). With workers > 1 the
+        paths are processed by a pool of that many processes, at most one
+        per CPU (see _pool_size).
+
+        With tilesize set, the bitmap is decomposed tile by tile and the
+        paths are stitched across the seams (see bm_to_pathlist_tiled);
+        backend is ignored and workers also applies to the tiles.
+
+        observer, if given, is told about the progress of the trace: see
+        trace_stats.TraceObserver for the methods it is called with.
+
+        budget, a TraceBudget or a number of seconds, bounds the time of
+        the trace. Once it runs out, no more paths are decomposed, and the
+        paths that are not processed yet get a polygon of corners instead
+        of a fitted curve: their optimal polygon if it was computed, else
+        the corners of their outline (Curve.degraded). Under a budget,
+        paths are processed in batches of BUDGET_BATCH, and the paths of
+        the batch at hand are degraded too. The result is then flagged
+        as Path.partial. A tiled decomposition stops between tiles and
+        keeps only the paths closed by then. Pool workers check their own
+        copy of the budget, which cancel() does not reach, and having a
+        CPU each, stop before the deadline like the trace.
+        """
+        budget = _as_budget(budget)
+        if tilesize is not None:
+            plist = _observe(
+                observer,
+                "bm_to_pathlist_tiled",
+                bm_to_pathlist_tiled,
+                self.data,
+                tilesize=tilesize,
+                turdsize=turdsize,
+                turnpolicy=turnpolicy,
+                workers=workers,
+                budget=budget,
+            )
+        else:
+            plist = bm_to_pathlist(
+                self._padded(backend),
+                turdsize=turdsize,
+                turnpolicy=turnpolicy,
+                observer=observer,
+                budget=budget,
+            )
         process_path(
             plist,
             alphamax=alphamax,
             opticurve=opticurve,
             opttolerance=opttolerance,
+            workers=workers,
+            observer=observer,
+            budget=budget,
+        )
+        return Path(plist, partial=budget is not None and budget.exhausted)
+
+    def trace_iter(
+        self,
+        turdsize: int = 2,
+        turnpolicy: int = POTRACE_TURNPOLICY_MINORITY,
+        alphamax=1.0,
+        opticurve=True,
+        opttolerance=0.2,
+        backend: str = "dense",
+        observer=None,
+        budget=None,
+    ):
+        """
+        Like trace, but a generator: each path is processed as soon as it
+        is decomposed and its Curve is yielded right away, in the order of
+        trace. The intermediate data of a path is dropped once its curve
+        is final, so only one path is worked on at a time. The curves are
+        not arranged in a tree (children is empty); use trace when the
+        nesting is needed. Once the budget runs out, the curve at hand is
+        yielded degraded and the generator stops; the exhausted flag of
+        a TraceBudget tells afterwards whether that happened.
+        """
+        budget = _as_budget(budget)
+        for p in iter_pathlist(
+            self._padded(backend),
+            turdsize=turdsize,
+            turnpolicy=turnpolicy,
+            budget=budget,
+        ):
+            _process_one(p, alphamax, opticurve, opttolerance, observer, budget)
+            _release(p)
+            yield Curve(p)
+
+    def trace_polygons(
+        self,
+        turdsize: int = 2,
+        turnpolicy: int = POTRACE_TURNPOLICY_MINORITY,
+        adjust: bool = False,
+        backend: str = "dense",
+        observer=None,
+        budget=None,
+    ) -> tuple:
+        """
+        Like trace, but stops at the optimal polygons, e.g. to triangulate
+        and extrude them: the curve stages are skipped. Returns the arrays
+        (points, offsets, parent) of polygons_to_numpy: lattice points,
+        or with adjust the vertices moved to fit the outline best, as the
+        curves of trace have them before smoothing.
+        """
+        budget = _as_budget(budget)
+        plist = bm_to_pathlist(
+            self._padded(backend),
+            turdsize=turdsize,
+            turnpolicy=turnpolicy,
+            observer=observer,
+            budget=budget,
         )
-        return Path(plist)
+        process_polygons(plist, adjust=adjust, observer=observer, budget=budget)
+        return polygons_to_numpy(plist, adjust=adjust)
+
+    def _padded(self, backend: str):
+        """the working bitmap for bm_to_pathlist in the given backend"""
+        if backend == "dense":
+            if self.data.base is self._buffer:
+                return self._buffer
+            return np.pad(self.data, [(0, 1), (0, 1)], mode="constant")
+        if backend == "packed":
+            return _PackedBitmap.frombool(self.data)
+        if backend == "rle":
+            return _RunBitmap.frombool(self.data)
+        raise ValueError("unknown bitmap backend %r" % backend)
 
 
 class Path(list):
-    def __init__(self, plist):
+    def __init__(self, plist, partial: bool = False):
         list.__init__(self)
+        self.partial = partial  # /* the trace ran out of budget */
         self.extend([Curve(p) for p in plist])
+        curves = {id(c._path): c for c in self}
+        self._tree = [curves[id(p)] for p in pathlist_to_tree(plist)]
+        for c in self:
+            c._children = [curves[id(p)] for p in c._path.childlist]
 
     @property
     def curves(self):
@@ -72,25 +361,42 @@ class Path(list):
     @property
     def curves_tree(self):
         """
-        Curves tree is currently non-implemented.
+        The top-level curves; the holes of each are in its children, and
+        the curves inside those holes in theirs, and so on.
         :return:
         """
-        return None
+        return self._tree
+
+    def to_numpy(self):
+        """
+        All curves in one columnar buffer, see Curve.to_numpy. Returns
+        (tags, c, offsets): the segments of curve i are
+        tags[offsets[i]:offsets[i+1]] and c[offsets[i]:offsets[i+1]].
+        :return:
+        """
+        offsets = np.zeros(len(self) + 1, dtype=np.intp)
+        np.cumsum([len(curve) for curve in self], out=offsets[1:])
+        tags = np.empty(offsets[-1], dtype=np.int8)
+        c = np.empty((offsets[-1], 3, 2))
+        for i, curve in enumerate(self):
+            a, b = offsets[i], offsets[i + 1]
+            tags[a:b], c[a:b] = curve.to_numpy()
+        return tags, c, offsets
 
 
 class Curve(list):
     def __init__(self, p):
         list.__init__(self)
-        last = None
         self._path = p
         self._curve = p._fcurve
-        for s in self._curve:
-            if s.tag == POTRACE_CORNER:
-                self.append(CornerSegment(s))
-            else:
-                self.append(BezierSegment(s))
-            last = s
-        self.start_point = last.c[2] if last is not None else None
+        self._children = []
+        self.extend(
+            [
+                CornerSegment(s) if s.tag == POTRACE_CORNER else BezierSegment(s)
+                for s in self._curve
+            ]
+        )
+        self.start_point = self._curve[-1].c[2] if len(self._curve) else None
 
     @property
     def decomposition_points(self):
@@ -103,10 +409,39 @@ class Curve(list):
     @property
     def children(self):
         """
-        Curves tree is non-implemented.
+        The curves directly inside this one: holes of a positive curve,
+        or the positive curves inside a hole.
         :return:
         """
-        return None
+        return self._children
+
+    @property
+    def degraded(self):
+        """
+        True if the trace ran out of budget before this curve was fitted,
+        and it is only a polygon of corners.
+        :return:
+        """
+        return self._path.degraded
+
+    def to_numpy(self):
+        """
+        The segments as arrays: tags (m,) of POTRACE_CORNER or
+        POTRACE_CURVETO and c (m, 3, 2) of control points. A curveto is
+        c1, c2, end_point; a corner is c, c, end_point. The curve starts
+        at the end point of its last segment.
+        :return:
+        """
+        m = len(self._curve)
+        tags = np.empty(m, dtype=np.int8)
+        c = np.empty((m, 3, 2))
+        for i, s in enumerate(self._curve):
+            tags[i] = s.tag
+            c0, c1, c2 = s.c
+            if s.tag == POTRACE_CORNER:
+                c0 = c1
+            c[i] = ((c0.x, c0.y), (c1.x, c1.y), (c2.x, c2.y))
+        return tags, c
 
 
 class CornerSegment:
@@ -167,11 +502,12 @@ class _Curve:
 
 
 class _Path:
-    def __init__(self, pt: list, area: int, sign: bool):
-        self.pt = pt  # /* pt[len]: path as extracted from bitmap */
+    def __init__(self, pt: np.ndarray, area: int, sign: bool):
+        self.pt = pt  # /* pt[len]: path as extracted from bitmap, int32 (x, y) rows */
 
         self.area = area
         self.sign = sign
+        self.degraded = False  # /* fcurve is a polygon, for lack of budget */
         self.next = None
         self.childlist = []
         self.sibling = []
@@ -180,7 +516,7 @@ class _Path:
 
         self._x0 = 0  # /* origin for sums */
         self._y0 = 0  # /* origin for sums */
-        self._sums = []  # / *sums[len + 1]: cache for fast summing * /
+        self._sums = None  # /* sums[len + 1]: cache for fast summing, columns x, y, x2, xy, y2 */
 
         self._m = 0  # /* length of optimal polygon */
         self._po = []  # /* po[m]: optimal polygon */
@@ -214,15 +550,6 @@ class _Segment:
         self.beta = 0.0
 
 
-class _Sums:
-    def __init__(self):
-        self.x = 0
-        self.y = 0
-        self.x2 = 0
-        self.xy = 0
-        self.y2 = 0
-
-
 detrand_t = (
     # /* non-linear sequence: constant term of inverse in GF(8),
     #   mod x^8+x^4+x^3+x+1 */
@@ -502,26 +829,21 @@ def majority(bm: np.array, x: int, y: int) -> int:
     """
      /* return the "majority" value of bitmap bm at intersection (x,y). We
     assume that the bitmap is balanced at "radius" 1.  */
+
+    Pixels outside the bitmap count as white, as BM_GET does in potrace.
     """
+    h, w = bm.shape
+
+    def get(yy, xx):
+        return 1 if 0 <= yy < h and 0 <= xx < w and bm.item(yy, xx) else -1
+
     for i in range(2, 5):  # /* check at "radius" i */
         ct = 0
         for a in range(-i + 1, i - 2):
-            try:
-                ct += 1 if bm[y + i - 1][x + a] else -1
-            except IndexError:
-                pass
-            try:
-                ct += 1 if bm[y + a - 1][x + i - 1] else -1
-            except IndexError:
-                pass
-            try:
-                ct += 1 if bm[y - i][x + a - 1] else -1
-            except IndexError:
-                pass
-            try:
-                ct += 1 if bm[y + a][x - i] else -1
-            except IndexError:
-                pass
+            ct += get(y + i - 1, x + a)
+            ct += get(y + a - 1, x + i - 1)
+            ct += get(y - i, x + a - 1)
+            ct += get(y + a, x - i)
         if ct > 0:
             return 1
         elif ct < 0:
@@ -535,13 +857,169 @@ def majority(bm: np.array, x: int, y: int) -> int:
 """
 
 
+class _PackedBitmap:
+    """
+    Bit-packed bitmap: 8 pixels per byte, pixel x of row y is bit (x & 7)
+    of words[y, x >> 3]. This is the BM_WORDBITS layout of the C potrace
+    with 8-bit words, and needs an eighth of the memory of a bool array.
+    Excess bits past the end of each row are kept clear, as required by
+    findnext. Implements the part of the ndarray interface (shape, item,
+    copy) used by findpath and majority.
+    """
+
+    def __init__(self, words: np.ndarray, width: int):
+        self.words = words
+        self.shape = (words.shape[0], width)
+
+    @classmethod
+    def frombool(cls, data: np.ndarray) -> "_PackedBitmap":
+        """Pack a bool array, padded with a clear row and column like the
+        dense bitmap handed to bm_to_pathlist."""
+        h, w = data.shape
+        words = np.zeros((h + 1, (w + 8) // 8), dtype=np.uint8)
+        words[:h, : (w + 7) // 8] = np.packbits(data, axis=1, bitorder="little")
+        return cls(words, w + 1)
+
+    def copy(self) -> "_PackedBitmap":
+        return _PackedBitmap(self.words.copy(), self.shape[1])
+
+    def item(self, y: int, x: int) -> bool:
+        h, w = self.shape
+        if not (-h <= y < h and -w <= x < w):
+            raise IndexError("pixel (%d, %d) is out of bounds" % (x, y))
+        if x < 0:
+            x += w
+        return bool((self.words.item(y, x >> 3) >> (x & 7)) & 1)
+
+    def xor_span(self, y: int, x0: int, x1: int) -> None:
+        """invert bits [x0,x1) in line y, a word at a time"""
+        b0 = x0 >> 3
+        b1 = x1 >> 3
+        m0 = (0xFF << (x0 & 7)) & 0xFF  # /* bits >= x0 in word b0 */
+        m1 = (1 << (x1 & 7)) - 1  # /* bits < x1 in word b1 */
+        row = self.words[y]
+        if b0 == b1:
+            row[b0] ^= m0 & m1
+            return
+        row[b0] ^= m0
+        np.invert(row[b0 + 1 : b1], out=row[b0 + 1 : b1])
+        if m1:
+            row[b1] ^= m1
+
+    def findnext(self, y: int, x: int) -> Optional[Tuple[int, int]]:
+        """packed version of findnext: test whole words, then the bits of
+        the first non-empty one."""
+        w = self.shape[1]
+        while y >= 0:
+            if x < w:
+                row = self.words[y]
+                b = x >> 3
+                word = row.item(b) & (0xFF << (x & 7))
+                if not word:
+                    nz = row[b + 1 :].nonzero()[0]
+                    if len(nz):
+                        b += 1 + int(nz[0])
+                        word = row.item(b)
+                if word:
+                    return y, (b << 3) + (word & -word).bit_length() - 1
+            y -= 1
+            x = 0
+        return None
+
+    def runs(self) -> Tuple[np.ndarray, ...]:
+        """the runs of set pixels, unpacking a band of rows at a time"""
+        w = self.shape[1]
+
+        def band(y0: int, y1: int) -> np.ndarray:
+            rows = self.words[y0:y1]
+            return np.unpackbits(rows, axis=1, count=w, bitorder="little").view(bool)
+
+        return _band_runs(self.shape, band)
+
+
+class _RunBitmap:
+    """
+    Run-length encoded bitmap: rows[y] is the sorted list of the x where
+    the pixels of row y change, so its set pixels are the runs
+    [rows[y][0], rows[y][1]), [rows[y][2], rows[y][3]), ... Inverting a
+    span toggles its two ends in the list, so the cost of decomposing a
+    mostly white scan grows with its runs, not with its area. Implements
+    the interface of _PackedBitmap.
+    """
+
+    def __init__(self, rows: list, width: int):
+        self.rows = rows
+        self.shape = (len(rows), width)
+
+    @classmethod
+    def frombool(cls, data: np.ndarray) -> "_RunBitmap":
+        """Encode a bool array, padded with a clear row and column like the
+        dense bitmap handed to bm_to_pathlist."""
+        h, w = data.shape
+        ys, x0, x1 = _dense_runs(data)
+        ends = np.stack([x0, x1], axis=1).ravel().tolist()
+        bounds = (2 * np.searchsorted(ys, np.arange(h + 1))).tolist()
+        rows = [ends[a:b] for a, b in zip(bounds, bounds[1:])]
+        rows.append([])
+        return cls(rows, w + 1)
+
+    def copy(self) -> "_RunBitmap":
+        return _RunBitmap([row.copy() for row in self.rows], self.shape[1])
+
+    def item(self, y: int, x: int) -> bool:
+        h, w = self.shape
+        if not (-h <= y < h and -w <= x < w):
+            raise IndexError("pixel (%d, %d) is out of bounds" % (x, y))
+        if x < 0:
+            x += w
+        # /* pixel x is set if an odd number of changes are at or before it */
+        return bisect_right(self.rows[y], x) & 1 == 1
+
+    def xor_span(self, y: int, x0: int, x1: int) -> None:
+        """invert pixels [x0,x1) in line y by toggling changes at x0 and x1"""
+        row = self.rows[y]
+        for x in (x0, x1):
+            i = bisect_left(row, x)
+            if i < len(row) and row[i] == x:
+                del row[i]
+            else:
+                row.insert(i, x)
+
+    def findnext(self, y: int, x: int) -> Optional[Tuple[int, int]]:
+        """run version of findnext: the first change after x in the row,
+        or the first start of a later non-empty row."""
+        rows = self.rows
+        while y >= 0:
+            row = rows[y]
+            if row:
+                i = bisect_right(row, x)
+                if i & 1:
+                    return y, x
+                if i < len(row):
+                    return y, row[i]
+            y -= 1
+            x = 0
+        return None
+
+    def runs(self) -> Tuple[np.ndarray, ...]:
+        """the runs of set pixels, as _dense_runs"""
+        counts = [len(row) // 2 for row in self.rows]
+        ends = np.fromiter(
+            itertools.chain.from_iterable(self.rows), np.intp, 2 * sum(counts)
+        )
+        return np.repeat(np.arange(len(counts)), counts), ends[0::2], ends[1::2]
+
+
 def xor_to_ref(bm: np.array, x: int, y: int, xa: int) -> None:
     """
      /* efficiently invert bits [x,infty) and [xa,infty) in line y. Here xa
     must be a multiple of BM_WORDBITS. */
     """
 
-    if x < xa:
+    if isinstance(bm, (_PackedBitmap, _RunBitmap)):
+        if x != xa:
+            bm.xor_span(y, min(x, xa), max(x, xa))
+    elif x < xa:
         bm[y, x:xa] ^= True
     elif x != xa:
         bm[y, xa:x] ^= True
@@ -560,17 +1038,62 @@ def xor_path(bm: np.array, p: _Path) -> None:
     """
     if len(p) <= 0:  # /* a path of length 0 is silly, but legal */
         return
+    if len(p) >= XOR_SPANS and not isinstance(bm, _RunBitmap):
+        _xor_spans(bm, p)
+        return
 
-    y1 = p.pt[-1].y
-    xa = p.pt[0].x
-    for n in p.pt:
-        x, y = n.x, n.y
+    y1 = p.pt.item(-1, 1)
+    xa = p.pt.item(0, 0)
+    for x, y in p.pt.tolist():
         if y != y1:
             # /* efficiently invert the rectangle [x,xa] x [y,y1] */
             xor_to_ref(bm, x, min(y, y1), xa)
             y1 = y
 
 
+XOR_SPANS = 128  # /* shorter paths are xor-ed one span at a time */
+
+
+def _xor_spans(bm, p: _Path) -> None:
+    """
+    xor_path for a bool array or a _PackedBitmap with all spans at once.
+    The span [x,xa) of each vertical step inverts the pixels from x and
+    from xa on, so these toggles are set as bits of a difference bitmap
+    over the bounding box of the path, 64 pixels to a word. A prefix XOR
+    along each row, first within the words by shifting and then across
+    them by the parity of the words before, gives the pixels to invert.
+    """
+    pt = p.pt
+    y = pt[:, 1]
+    prev = np.roll(y, 1)
+    step = y != prev
+    x0, y0 = pt.min(axis=0).tolist()
+    x1, y1 = pt.max(axis=0).tolist()
+    packed = isinstance(bm, _PackedBitmap)
+    lo = x0 & ~7 if packed else x0  # /* whole bytes for a packed bitmap */
+    rows = np.minimum(y, prev)[step] - y0
+    odd = np.flatnonzero(np.bincount(rows, minlength=y1 - y0) & 1)
+    ty = np.concatenate([rows, odd])
+    tx = np.concatenate([pt[step, 0], np.full(len(odd), pt.item(0, 0))]) - lo
+    words = np.zeros((y1 - y0, ((x1 - lo) >> 6) + 1), dtype="<u8")
+    bits = np.left_shift(np.uint64(1), (tx & 63).astype(np.uint64))
+    np.bitwise_xor.at(words, (ty, tx >> 6), bits)
+    for shift in (1, 2, 4, 8, 16, 32):
+        words ^= words << np.uint64(shift)
+    carry = np.bitwise_xor.accumulate(words[:, :-1] >> np.uint64(63), axis=1)
+    words[:, 1:] ^= carry * np.uint64(0xFFFFFFFFFFFFFFFF)
+    mask = words.view(np.uint8)
+    if packed:
+        nb = ((x1 - 1) >> 3) + 1 - (lo >> 3)
+        bm.words[y0:y1, lo >> 3 : (lo >> 3) + nb] ^= mask[:, :nb]
+    else:
+        step = max(1, RUNS_BAND // (x1 - lo))  # /* unpacked a band at a time */
+        for y in range(y0, y1, step):
+            band = mask[y - y0 : y - y0 + step]
+            band = np.unpackbits(band, axis=1, count=x1 - lo, bitorder="little")
+            bm[y : y + len(band), lo:x1] ^= band.view(bool)
+
+
 def findpath(bm: np.array, x0: int, y0: int, sign: bool, turnpolicy: int) -> _Path:
     """
     /* compute a path in the given pixmap, separating black from white.
@@ -580,16 +1103,27 @@ def findpath(bm: np.array, x0: int, y0: int, sign: bool, turnpolicy: int) -> _Pa
     cannot have length 0). Sign is required for correct interpretation
     of turnpolicies. */"""
 
+    if _jit is not None and isinstance(bm, np.ndarray):
+        pt, area = _jit.findpath(bm, x0, y0, sign, turnpolicy)
+        return _Path(pt, int(area), sign)
+
     x = x0
     y = y0
     dirx = 0
     diry = -1  # diry-1
-    pt = []
+    pt = np.empty((256, 2), dtype=np.int32)  # /* growable point buffer */
+    n = 0
     area = 0
 
     while True:  # /* while this path */
         # /* add point to path */
-        pt.append(_Point(int(x), int(y)))
+        if n == len(pt):
+            buf = np.empty((2 * n, 2), dtype=np.int32)
+            buf[:n] = pt
+            pt = buf
+        pt[n, 0] = x
+        pt[n, 1] = y
+        n += 1
 
         # /* move to next point */
         x += dirx
@@ -604,13 +1138,13 @@ def findpath(bm: np.array, x0: int, y0: int, sign: bool, turnpolicy: int) -> _Pa
         cy = y + (diry - dirx - 1) // 2
         cx = x + (dirx + diry - 1) // 2
         try:
-            c = bm[cy][cx]
+            c = bm.item(cy, cx)
         except IndexError:
             c = 0
         dy = y + (diry + dirx - 1) // 2
         dx = x + (dirx - diry - 1) // 2
         try:
-            d = bm[dy][dx]
+            d = bm.item(dy, dx)
         except IndexError:
             d = 0
 
@@ -642,25 +1176,270 @@ def findpath(bm: np.array, x0: int, y0: int, sign: bool, turnpolicy: int) -> _Pa
             diry = tmp
 
     # /* allocate new path object */
-    return _Path(pt, area, sign)
+    return _Path(pt[:n].copy(), area, sign)
 
 
-def findnext(bm: np.array) -> Optional[Tuple[Union[int], int]]:
+def findnext(
+    bm: np.array, y: Optional[int] = None, x: int = 0
+) -> Optional[Tuple[int, int]]:
     """
     /* find the next set pixel in a row <= y. Pixels are searched first
        left-to-right, then top-down. In other words, (x,y)<(x',y') if y>y'
        or y=y' and x<x'. If found, return 0 and store pixel in
        (*xp,*yp). Else return 1. Note that this function assumes that
        excess bytes have been cleared with bm_clearexcess. */
+
+    The search resumes at (x, y), which is a scan cursor as returned by a
+    previous call: decomposing a path only ever clears pixels at or after
+    the cursor, so the rows already passed never need to be searched
+    again. Each row is searched with a single vectorized scan.
     """
-    w = np.nonzero(bm)
-    if len(w[0]) == 0:
-        return None
+    h, w = bm.shape
+    if y is None:
+        y = h - 1
+    if isinstance(bm, (_PackedBitmap, _RunBitmap)):
+        return bm.findnext(y, x)
+    while y >= 0:
+        if x < w:
+            row = bm[y, x:]
+            i = int(row.argmax())
+            if row[i]:
+                return y, x + i
+        y -= 1
+        x = 0
+    return None
+
+
+RUNS_BAND = 1 << 20  # /* pixels scanned for runs at a time */
+
+
+def _band_runs(shape: Tuple[int, int], band) -> Tuple[np.ndarray, ...]:
+    """
+    The rows ys, starts x0 and ends x1 (exclusive) of all runs of set
+    pixels of a bitmap of the given shape, in the order of the bitmap;
+    band(y0, y1) returns its rows y0:y1 as a bool array. The rows are
+    scanned a band of about RUNS_BAND pixels at a time, so that the
+    temporaries stay small on large scans.
+    """
+    h, w = shape
+    step = max(1, RUNS_BAND // (w + 2))
+    padded = np.zeros((min(step, h), w + 2), dtype=bool)
+    ys, x0, x1 = [np.zeros(0, dtype=np.intp)], [], []
+    for y in range(0, h, step):
+        rows = band(y, min(y + step, h))
+        n = len(rows)
+        padded[:n, 1:-1] = rows
+        # /* alternately the start and end of a run */
+        edges = np.flatnonzero(padded[:n, 1:] != padded[:n, :-1])
+        r, x = np.divmod(edges[0::2], w + 1)
+        ys.append(r + y)
+        x0.append(x)
+        x1.append(edges[1::2] - r * (w + 1))
+    ys = np.concatenate(ys)
+    return ys, np.concatenate(x0 or [ys]), np.concatenate(x1 or [ys])
+
+
+def _dense_runs(data: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """the runs of set pixels of a bool array, see _band_runs"""
+    return _band_runs(data.shape, lambda y0, y1: data[y0:y1])
+
+
+def _gaps(runs: tuple, shape: Tuple[int, int]) -> Tuple[np.ndarray, ...]:
+    """
+    The runs of clear pixels of a bitmap of the given shape whose runs of
+    set pixels are runs (ys, x0, x1). In each row, the gaps start at 0 and
+    at the ends of the runs, and end at the starts of the runs and at the
+    width, so sorting both lists pairs them up; empty gaps are dropped.
+    """
+    ys, x0, x1 = runs
+    h, w = shape
+    k = w + 1
+    rows = np.arange(h) * k
+    starts = np.sort(np.concatenate([rows, ys * k + x1]))
+    ends = np.sort(np.concatenate([ys * k + x0, rows + w]))
+    keep = ends > starts
+    gy, g0 = np.divmod(starts[keep], k)
+    return gy, g0, ends[keep] - gy * k
+
+
+def _label_runs(runs: tuple, w: int) -> np.ndarray:
+    """
+    Label the 8-connected components of a bitmap of width w by its runs
+    (ys, x0, x1), given in the order of the bitmap. Returns for each run
+    the label of its component, which is the index of the component's
+    first run.
+
+    Runs in adjacent rows are joined if they touch, even at a corner; the
+    runs of the row above a run that touch it are contiguous and found
+    with two searchsorted. The components are then merged by a vectorized
+    union-find: every round, each root is hooked to the smallest root it
+    shares an edge with and the labels are compressed by pointer jumping,
+    until the ends of all edges agree.
+    """
+    ys, x0, x1 = runs
+    n = len(ys)
+    labels = np.arange(n)
+    if n == 0:
+        return labels
+
+    k = w + 2
+    above = (ys - 1) * k
+    lo = np.searchsorted(ys * k + x1, above + x0, "left")
+    hi = np.searchsorted(ys * k + x0, above + x1, "right")
+    cnt = np.maximum(hi - lo, 0)
+    u = np.repeat(labels, cnt)
+    v = np.repeat(lo - (np.cumsum(cnt) - cnt), cnt) + np.arange(cnt.sum())
+
+    while len(u):
+        lu = labels[u]
+        lv = labels[v]
+        keep = lu != lv
+        u, v, lu, lv = u[keep], v[keep], lu[keep], lv[keep]
+        if not len(u):
+            break
+        np.minimum.at(labels, np.maximum(lu, lv), np.minimum(lu, lv))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels
 
-    q = np.where(w[0] == w[0][-1])
-    y = w[0][q]
-    x = w[1][q]
-    return y[0], x[0]
+
+def _speck_runs(
+    runs: tuple,
+    shape: Tuple[int, int],
+    turdsize: int,
+    turnpolicy: int,
+    holes: bool = False,
+) -> np.ndarray:
+    """
+    Which of the runs (ys, x0, x1) of a bitmap of the given shape belong to
+    its specks: the 8-connected components whose paths bm_to_pathlist
+    would all discard as turds, and which can be erased up front without
+    changing any other path. With holes, the runs are the gaps of the
+    bitmap (see _gaps), and the specks are its small holes; the outside of
+    the array then counts as set, so that a component at the edge of the
+    array is never a speck.
+
+    A path of a component never leaves the component's bounding box, and
+    encloses only the component's pixels unless the component has a hole,
+    which takes at least 4 pixels. So every path of a component with at
+    most turdsize pixels has an area <= turdsize if it has fewer than 4
+    pixels or its bounding box is no larger than turdsize; decomposing it
+    just clears its pixels. Other paths only look at their own pixels,
+    except for the majority and minority turn policies: at an ambiguous
+    vertex (two pixels set on one diagonal, clear on the other), majority
+    looks up to 4 pixels away, so a speck that near an ambiguous vertex of
+    another component is kept.
+    """
+    ys, x0, x1 = runs
+    h, w = shape
+    small = np.zeros(len(ys), dtype=bool)
+    if turdsize < 1 or not len(ys):
+        return small
+    labels = _label_runs(runs, w)
+    area = np.bincount(labels, weights=x1 - x0, minlength=len(ys))
+    speck = area <= turdsize
+    if holes:
+        edge = (ys == 0) | (ys == h - 1) | (x0 == 0) | (x1 == w)
+        speck[labels[edge]] = False
+    small = speck[labels]
+    if not small.any():
+        return small
+
+    big = np.nonzero(small & (area[labels] >= 4))[0]
+    if len(big):
+        top = np.full(len(ys), h)
+        bottom = np.full(len(ys), -1)
+        left = np.full(len(ys), w)
+        right = np.full(len(ys), -1)
+        lb = labels[big]
+        np.minimum.at(top, lb, ys[big])
+        np.maximum.at(bottom, lb, ys[big])
+        np.minimum.at(left, lb, x0[big])
+        np.maximum.at(right, lb, x1[big])
+        roots = np.unique(lb)
+        box = (bottom[roots] - top[roots] + 1) * (right[roots] - left[roots])
+        speck[roots[box > turdsize]] = False
+        small = speck[labels]
+
+    if turnpolicy in (POTRACE_TURNPOLICY_MINORITY, POTRACE_TURNPOLICY_MAJORITY):
+        # /* vertices where another path may call majority: a run of row y
+        #    ends where one of row y+1 starts, or starts where one ends.
+        #    The run of row y has a set pixel of the vertex. */
+        k = w + 1
+        starts = ys * k + x0
+        ends = ys * k + x1
+        _, a, _ = np.intersect1d(ends + k, starts, True, return_indices=True)
+        _, b, _ = np.intersect1d(starts + k, ends, True, return_indices=True)
+        run = np.concatenate([a, b])
+        vy = ys[run] + 1
+        vx = np.concatenate([x1[a], x0[b]])
+        keep = ~speck[labels[run]]
+        order = np.argsort(vy[keep] * k + vx[keep], kind="stable")
+        idx = np.nonzero(small)[0]
+        near = _near_vertices(
+            (ys[idx], x0[idx], x1[idx]), vy[keep][order], vx[keep][order], w
+        )
+        speck[labels[idx[near]]] = False
+        small = speck[labels]
+    return small
+
+
+def _near_vertices(runs: tuple, vy: np.ndarray, vx: np.ndarray, w: int) -> np.ndarray:
+    """
+    For each of the runs (ys, x0, x1), whether it has a pixel that majority
+    looks at for one of the vertices (vx, vy), given in row-major order:
+    the pixels up to 4 rows and columns away from the vertex. In each row,
+    only the first vertex at or after x0 - 3 can be near, and it is found
+    with a single searchsorted.
+    """
+    ys, x0, x1 = runs
+    near = np.zeros(len(ys), dtype=bool)
+    if not len(vy):
+        return near
+    k = w + 8
+    keys = vy * k + vx + 4
+    for dy in range(-3, 5):
+        i = np.searchsorted(keys, (ys + dy) * k + x0 + 1, "left")
+        i = np.minimum(i, len(vy) - 1)
+        near |= (vy[i] == ys + dy) & (vx[i] <= x1 + 3)
+    return near
+
+
+def _run_pixels(ys: np.ndarray, x0: np.ndarray, x1: np.ndarray) -> tuple:
+    """the pixels of the runs (ys, x0, x1), as an index into the bitmap"""
+    length = x1 - x0
+    start = np.cumsum(length) - length
+    x = np.arange(length.sum()) + np.repeat(x0 - start, length)
+    return np.repeat(ys, length), x
+
+
+def _xor_runs(bm, ys: np.ndarray, x0: np.ndarray, x1: np.ndarray) -> None:
+    """invert the runs (ys, x0, x1) of the working bitmap bm"""
+    if isinstance(bm, np.ndarray):
+        bm[_run_pixels(ys, x0, x1)] ^= True
+        return
+    for y, a, b in zip(ys.tolist(), x0.tolist(), x1.tolist()):
+        bm.xor_span(y, a, b)
+
+
+def _erase_specks(bm, turdsize: int, turnpolicy: int) -> None:
+    """
+    Clear the specks (see _speck_runs) of the working bitmap bm, and then
+    fill its small holes, so that the decomposition skips them. The holes
+    are looked for once the specks are gone, as a speck may be what
+    encloses them; the runs left are those that are not specks.
+    """
+    if turdsize < 1:
+        return
+    runs = _dense_runs(bm) if isinstance(bm, np.ndarray) else bm.runs()
+    small = _speck_runs(runs, bm.shape, turdsize, turnpolicy)
+    _xor_runs(bm, *(r[small] for r in runs))
+    gaps = _gaps(tuple(r[~small] for r in runs), bm.shape)
+    small = _speck_runs(gaps, bm.shape, turdsize, turnpolicy, holes=True)
+    _xor_runs(bm, *(r[small] for r in gaps))
 
 
 def setbbox_path(p: _Path):
@@ -668,26 +1447,40 @@ def setbbox_path(p: _Path):
      /* Find the bounding box of a given path. Path is assumed to be of
     non-zero length. */
     """
-    y0 = float("inf")
-    y1 = 0
-    x0 = float("inf")
-    x1 = 0
-    for k in range(len(p)):
-        x = p.pt[k].x
-        y = p.pt[k].y
-
-        if x < x0:
-            x0 = x
-        if x > x1:
-            x1 = x
-        if y < y0:
-            y0 = y
-        if y > y1:
-            y1 = y
+    x0, y0 = p.pt.min(axis=0).tolist()
+    x1, y1 = p.pt.max(axis=0).tolist()
     return x0, y0, x1, y1
 
 
-def pathlist_to_tree(plist: list, bm: np.array) -> None:
+def _row_crossings(p: _Path) -> dict:
+    """
+    map each pixel row y crossed by path p to the sorted x coordinates of
+    its vertical edges between y and y+1.
+    """
+    pt = p.pt
+    nxt = np.roll(pt, -1, axis=0)
+    vert = pt[:, 0] == nxt[:, 0]
+    xs = pt[vert, 0]
+    ys = np.minimum(pt[vert, 1], nxt[vert, 1])
+    order = np.lexsort((xs, ys))
+    xs, ys = xs[order], ys[order]
+    rows, starts = np.unique(ys, return_index=True)
+    ends = np.append(starts[1:], len(ys))
+    return {
+        y: xs[s:e] for y, s, e in zip(rows.tolist(), starts.tolist(), ends.tolist())
+    }
+
+
+def _inside(crossings: dict, x: int, y: int) -> bool:
+    """is pixel (x,y) inside the path with the given _row_crossings?"""
+    xs = crossings.get(y)
+    if xs is None:
+        return False
+    # /* pixel x lies right of the edges at x' <= x */
+    return int(np.searchsorted(xs, x, side="right")) & 1 == 1
+
+
+def pathlist_to_tree(plist: list) -> list:
     """
     /* Give a tree structure to the given path list, based on "insideness"
        testing. I.e., path A is considered "below" path B if it is inside
@@ -700,139 +1493,134 @@ def pathlist_to_tree(plist: list, bm: np.array) -> None:
        structure, others may use it e.g. to group path components. We
        assume that in the input, point 0 of each path is an "upper left"
        corner of the path, as returned by bm_to_pathlist. This makes it
-       easy to find an "interior" point. The bm argument should be a
-       bitmap of the correct size (large enough to hold all the paths),
-       and will be used as scratch space. Return 0 on success or -1 on
-       error with errno set. */
-    """
-    # path_t *p, *p1
-    # path_t *heap, *heap1
-    # path_t *cur
-    # path_t *head
-    # path_t **plist_hook          #/* for fast appending to linked list */
-    # path_t **hook_in, **hook_out #/* for fast appending to linked list */
-    # bbox_t bbox
-
-    bm = bm.copy()
-
-    # /* save original "next" pointers */
-
-    for p in plist:
-        p.sibling = p.next
-        p.childlist = None
-
-    heap = plist
-    """
-      /* the heap holds a list of lists of paths. Use "childlist" field
-         for outer list, "next" field for inner list. Each of the sublists
-         is to be turned into a tree. This code is messy, but it is
-         actually fast. Each path is rendered exactly once. We use the
-         heap to get a tail recursive algorithm: the heap holds a list of
-         pathlists which still need to be transformed. */
+       easy to find an "interior" point. */
+
+    Instead of rendering each path into a scratch bitmap, the interior
+    pixel of a path is tested against its candidate parents by counting
+    the vertical edges to its left. The candidates are the earlier paths
+    whose bounding box (setbbox_path) covers the pixel, looked up in a
+    grid of buckets; the parent is the smallest one containing it.
+
+    Sets childlist (list of child paths), sibling (next path with the
+    same parent, or None) and next (the linked list order described
+    above) of every path, and returns the list of top-level paths. plist
+    itself is not reordered.
     """
+    n = len(plist)
+    if n == 0:
+        return []
+    bbox = np.array([setbbox_path(p) for p in plist], dtype=np.int64)
+    x0, y0 = int(bbox[:, 0].min()), int(bbox[:, 1].min())
+    x1, y1 = int(bbox[:, 2].max()), int(bbox[:, 3].max())
+
+    # /* bucket size chosen so that there are about as many buckets as paths */
+    cell = max(8, int(math.sqrt((x1 - x0 + 1) * (y1 - y0 + 1) / n)) + 1)
+    buckets = {}
+    crossings = {}
+    parent = [None] * n
+    for i, p in enumerate(plist):
+        # /* interior point: the pixel whose corner is point 0 */
+        x, y = p.pt.item(0, 0), p.pt.item(0, 1) - 1
+        best = None
+        for j in buckets.get(((x - x0) // cell, (y - y0) // cell), ()):
+            bx0, by0, bx1, by1 = bbox[j].tolist()
+            if not (bx0 <= x < bx1 and by0 <= y < by1):
+                continue
+            if best is not None and plist[j].area >= plist[best].area:
+                continue
+            c = crossings.get(j)
+            if c is None:
+                c = crossings[j] = _row_crossings(plist[j])
+            if _inside(c, x, y):
+                best = j
+        parent[i] = best
+
+        bx0, by0, bx1, by1 = ((bbox[i] - [x0, y0, x0, y0]) // cell).tolist()
+        for cx in range(bx0, bx1 + 1):
+            for cy in range(by0, by1 + 1):
+                buckets.setdefault((cx, cy), []).append(i)
+
+    roots = []
+    for p in plist:
+        p.childlist = []
+        p.sibling = None
+    for i, p in enumerate(plist):
+        siblings = roots if parent[i] is None else plist[parent[i]].childlist
+        if siblings:
+            siblings[-1].sibling = p
+        siblings.append(p)
+
+    # /* reconstruct the linked list ("next") structure from the tree:
+    #    each positive path followed by its children, level by level */
+    order = []
+    heap = [roots]
     while heap:
-        # /* unlink first sublist */
-        cur = heap
-        heap = heap.childlist
-        cur.childlist = None
-
-        # /* unlink first path */
-        head = cur
-        cur = cur.next
-        head.next = None
-
-        # /* render path */
-        xor_path(bm, head)
-        x0, y0, x1, y1 = setbbox_path(head)
-
-        """
-        /* now do insideness test for each element of cur; append it to
-       head->childlist if it's inside head, else append it to
-       head->next. */
-       """
-        # hook_in= head.childlist
-        # hook_out= head.next
-        # list_forall_unlink(p, cur):
-        #     if p.priv.pt[0].y <= bbox.y0:
-        #         list_insert_beforehook(p, hook_out)
-        #         # /* append the remainder of the list to hook_out */
-        #         hook_out = cur
-        #         break
-        #     if (BM_GET(bm, p.priv.pt[0].x, p.priv.pt[0].y-1)):
-        #         list_insert_beforehook(p, hook_in)
-        #     else:
-        #         list_insert_beforehook(p, hook_out)
-
-    # /* clear bm */
-    # clear_bm_with_bbox(bm, &bbox)
-    #
-    # #/* now schedule head->childlist and head->next for further processing */
-    # if head.next:
-    #     head.next.childlist = heap
-    #     heap = head.next
-    # if head.childlist:
-    #     head.childlist.childlist = heap
-    #     heap = head->childlist
-    #
-    # #/* copy sibling structure from "next" to "sibling" component */
-    # p = plist
-    # while p:
-    #     p1 = p.sibling
-    #     p.sibling = p.next
-    #     p = p1
-    #
-    # """
-    # /* reconstruct a new linked list ("next") structure from tree
-    # ("childlist", "sibling") structure. This code is slightly messy,
-    # because we use a heap to make it tail recursive: the heap
-    # contains a list of childlists which still need to be
-    # processed. */"""
-    # heap = plist
-    # if heap:
-    #     heap.next = None  #/* heap is a linked list of childlists */
-    # plist = None
-    # plist_hook = plist
-    # while heap:
-    #     heap1 = heap.next
-    #     for (p=heap; p; p=p->sibling):
-    #         #/* p is a positive path */
-    #         #/* append to linked list */
-    #         list_insert_beforehook(p, plist_hook)
-    #
-    #         #/* go through its children */
-    #     for (p1=p->childlist; p1; p1=p1->sibling):
-    #         #/* append to linked list */
-
-
-#         list_insert_beforehook(p1, plist_hook);
-#         #/* append its childlist to heap, if non-empty */
-#     if (p1.childlist):
-#         list_append(path_t, heap1, p1->childlist)
-#     heap = heap1
+        level = heap.pop(0)
+        for p in level:
+            order.append(p)
+            for p1 in p.childlist:
+                order.append(p1)
+                if p1.childlist:
+                    heap.append(p1.childlist)
+    for p, p1 in zip(order, order[1:] + [None]):
+        p.next = p1
+    return roots
 
 
 def bm_to_pathlist(
-    bm: np.array, turdsize: int = 2, turnpolicy: int = POTRACE_TURNPOLICY_MINORITY
+    bm: np.array,
+    turdsize: int = 2,
+    turnpolicy: int = POTRACE_TURNPOLICY_MINORITY,
+    observer=None,
+    budget: Optional[TraceBudget] = None,
 ) -> list:
     """
     /* Decompose the given bitmap into paths. Returns a linked list of
     path_t objects with the fields len, pt, area, sign filled
     in. Returns 0 on success with plistp set, or -1 on error with errno
     set. */
+
+    bm is a padded bool array, a _PackedBitmap or a _RunBitmap; it is left
+    unchanged. The decomposition is reported to observer as the stage
+    "bm_to_pathlist". If budget runs out, the paths found so far are
+    returned.
+    """
+    return _observe(
+        observer,
+        "bm_to_pathlist",
+        list,
+        iter_pathlist(bm, turdsize=turdsize, turnpolicy=turnpolicy, budget=budget),
+    )
+
+
+def iter_pathlist(
+    bm: np.array,
+    turdsize: int = 2,
+    turnpolicy: int = POTRACE_TURNPOLICY_MINORITY,
+    budget: Optional[TraceBudget] = None,
+):
+    """
+    bm_to_pathlist as a generator, yielding each path as soon as it has
+    been found. The specks and small holes that would only be traced to
+    be discarded as turds are erased from the working copy first (see
+    _erase_specks), which saves most of the work on noisy scans.
     """
-    plist = []  # /* linked list of path objects */
-    original = bm.copy()
+    original = bm
+    bm = bm.copy()
+    _erase_specks(bm, turdsize, turnpolicy)
 
     """/* be sure the byte padding on the right is set to 0, as the fast
     pixel search below relies on it */"""
     # /* iterate through components */
+    y, x = bm.shape[0] - 1, 0
+    found = 0  # /* points of the paths yielded */
     while True:
-        n = findnext(bm)
-        if n is None:
+        n = findnext(bm, y, x)
+        if n is None or _out_of_budget(budget, found):
             break
         y, x = n
         # /* calculate the sign by looking at the original */
-        sign = original[y][x]
+        sign = original.item(y, x)
         # /* calculate the path */
         path = findpath(bm, x, y + 1, sign, turnpolicy)
         if path is None:
@@ -842,10 +1630,291 @@ def bm_to_pathlist(
         xor_path(bm, path)
 
         # /* if it's a turd, eliminate it, else append it to the list */
+        if path.area > turdsize:
+            found += len(path)
+            yield path
+
+
+"""
+/* ---------------------------------------------------------------------- */
+/* tiled decomposition */
+
+Instead of xor-ing paths out of one bitmap held in memory, the tiled
+decomposition follows every black/white boundary of the original bitmap,
+one tile at a time. Within a tile the boundary is walked with the turn
+rules of findpath, as if every path were positive; a walk stops when it
+leaves the vertices owned by the tile. The open chains are stitched back
+together across the seams, keyed on the (vertex, direction) state at
+which they leave one tile and enter the next. Finally each closed cycle
+is put into the form bm_to_pathlist gives it: holes are reversed, every
+cycle starts at the lower left corner of its first pixel in scan order,
+and the cycles are sorted in scan order.
+
+Ambiguous turns must be resolved the same way no matter which tile
+walks them, so only the turn policies that do not depend on the sign of
+the path are supported. With POTRACE_TURNPOLICY_BLACK and _WHITE the
+result equals that of bm_to_pathlist; with _MAJORITY and _MINORITY the
+majority is taken on the original bitmap rather than the partially
+xor-ed one, which can resolve an ambiguous turn differently when another
+path passes within a few pixels.
+"""
+
+_TILE_HALO = 5  # /* pixels around a tile needed by findpath and majority */
+
+
+def _tile_pixels(data: np.ndarray, r0: int, r1: int, c0: int, c1: int) -> np.ndarray:
+    """pixels [r0,r1) x [c0,c1) of data with a halo of _TILE_HALO, zero outside"""
+    h, w = data.shape
+    px = np.zeros((r1 - r0 + 2 * _TILE_HALO, c1 - c0 + 2 * _TILE_HALO), dtype=bool)
+    ya, yb = max(r0 - _TILE_HALO, 0), min(r1 + _TILE_HALO, h)
+    xa, xb = max(c0 - _TILE_HALO, 0), min(c1 + _TILE_HALO, w)
+    if ya < yb and xa < xb:
+        oy, ox = _TILE_HALO - r0, _TILE_HALO - c0
+        px[ya + oy : yb + oy, xa + ox : xb + ox] = data[ya:yb, xa:xb]
+    return px
+
+
+def _walk_tile(
+    px: np.ndarray, r0: int, c0: int, rows: int, cols: int, turnpolicy: int
+) -> Tuple[list, list]:
+    """
+    Follow the boundaries through the vertices (x,y) with r0<=y<r0+rows
+    and c0<=x<c0+cols, px being the pixels around them as returned by
+    _tile_pixels. Returns the cycles lying entirely within the tile, as
+    point arrays, and the chains crossing its border, as tuples (points,
+    start state, end state); a state (x,y,dirx,diry) is the arrival at
+    vertex (x,y) moving in direction (dirx,diry).
+    """
+    if turnpolicy not in (
+        POTRACE_TURNPOLICY_BLACK,
+        POTRACE_TURNPOLICY_WHITE,
+        POTRACE_TURNPOLICY_MAJORITY,
+        POTRACE_TURNPOLICY_MINORITY,
+    ):
+        raise ValueError("turn policy %d is not supported by tiled tracing" % turnpolicy)
+    oy, ox = _TILE_HALO - r0, _TILE_HALO - c0
+    x1, y1 = c0 + cols, r0 + rows
+    visited = set()
+
+    def walk(x, y, dirx, diry):
+        start = (x, y, dirx, diry)
+        pt = []
+        while True:
+            visited.add((x, y, dirx, diry))
+            pt.append((x, y))
+
+            # /* determine next direction, as in findpath */
+            c = px.item(y + (diry - dirx - 1) // 2 + oy, x + (dirx + diry - 1) // 2 + ox)
+            d = px.item(y + (diry + dirx - 1) // 2 + oy, x + (dirx - diry - 1) // 2 + ox)
+            if c and not d:  # /* ambiguous turn */
+                if turnpolicy == POTRACE_TURNPOLICY_BLACK:
+                    right = True
+                elif turnpolicy == POTRACE_TURNPOLICY_WHITE:
+                    right = False
+                else:
+                    right = majority(px, x + ox, y + oy)
+                    if turnpolicy == POTRACE_TURNPOLICY_MINORITY:
+                        right = not right
+                if right:
+                    dirx, diry = diry, -dirx
+                else:
+                    dirx, diry = -diry, dirx
+            elif c:  # /* right turn */
+                dirx, diry = diry, -dirx
+            elif not d:  # /* left turn */
+                dirx, diry = -diry, dirx
+
+            x += dirx
+            y += diry
+            if not (c0 <= x < x1 and r0 <= y < y1):
+                return np.array(pt, dtype=np.int32), start, (x, y, dirx, diry)
+            if (x, y, dirx, diry) == start:
+                return np.array(pt, dtype=np.int32), start, None
+
+    # /* arrivals at each owned vertex, by direction of the boundary edge */
+    def tile(dy, dx):
+        return px[
+            _TILE_HALO + dy : _TILE_HALO + dy + rows,
+            _TILE_HALO + dx : _TILE_HALO + dx + cols,
+        ]
+
+    cur, left, up, upleft = tile(0, 0), tile(0, -1), tile(-1, 0), tile(-1, -1)
+    arrivals = (
+        ((0, -1), cur & ~left),
+        ((0, 1), upleft & ~up),
+        ((1, 0), left & ~upleft),
+        ((-1, 0), up & ~cur),
+    )
+
+    # /* chains entering the tile: their previous vertex is not owned */
+    chains = []
+    for (dirx, diry), mask in arrivals:
+        entry = np.zeros_like(mask)
+        if diry == -1:
+            entry[-1] = mask[-1]
+        elif diry == 1:
+            entry[0] = mask[0]
+        elif dirx == 1:
+            entry[:, 0] = mask[:, 0]
+        else:
+            entry[:, -1] = mask[:, -1]
+        for y, x in zip(*np.nonzero(entry)):
+            chains.append(walk(c0 + int(x), r0 + int(y), dirx, diry))
+
+    # /* whatever has not been visited now are cycles inside the tile */
+    cycles = []
+    for (dirx, diry), mask in arrivals:
+        for y, x in zip(*np.nonzero(mask)):
+            state = (c0 + int(x), r0 + int(y), dirx, diry)
+            if state not in visited:
+                cycles.append(walk(*state)[0])
+    return cycles, chains
+
+
+def _trace_tile(
+    data: np.ndarray, r0: int, c0: int, rows: int, cols: int, turnpolicy: int
+) -> Tuple[list, list]:
+    """_walk_tile on the tile of data owning vertices [r0,r0+rows) x [c0,c0+cols)"""
+    px = _tile_pixels(data, r0, r0 + rows, c0, c0 + cols)
+    return _walk_tile(px, r0, c0, rows, cols, turnpolicy)
+
+
+def _cycle_to_path(pt: np.ndarray) -> _Path:
+    """
+    turn a closed boundary cycle, as walked by _walk_tile, into the path
+    bm_to_pathlist would have found for it.
+    """
+    # /* start at the lower left corner of the first pixel in scan order */
+    ymax = pt[:, 1].max()
+    s = int(np.flatnonzero(pt[:, 1] == ymax)[pt[pt[:, 1] == ymax, 0].argmin()])
+    n = len(pt)
+    sign = pt.item((s + 1) % n, 1) < ymax  # /* first step is up */
+    if sign:
+        pt = np.roll(pt, -s, axis=0)
+    else:
+        # /* holes were walked against their orientation in bm_to_pathlist */
+        pt = np.roll(pt[::-1], s + 1 - n, axis=0)
+    nxt = np.roll(pt, -1, axis=0).astype(np.int64)
+    area = int((nxt[:, 0] * (nxt[:, 1] - pt[:, 1])).sum())
+    return _Path(np.ascontiguousarray(pt), area, bool(sign))
+
+
+class _Chain:
+    """an open boundary chain being stitched across tile seams"""
+
+    def __init__(self, pt: np.ndarray, start: tuple, end: tuple):
+        self.pts = [pt]
+        self.start = start
+        self.end = end
+
+
+def bm_to_pathlist_tiled(
+    data: np.ndarray,
+    tilesize: int = 1024,
+    turdsize: int = 2,
+    turnpolicy: int = POTRACE_TURNPOLICY_MINORITY,
+    workers: Optional[int] = None,
+    budget: Optional[TraceBudget] = None,
+) -> list:
+    """
+    Decompose the bitmap data (True = black, not padded) into paths, one
+    tilesize x tilesize tile at a time, see above. Only one tile plus a
+    small halo is materialized at a time (per worker), so data may be a
+    np.memmap of a scan too big for memory. With workers > 1 the tiles
+    are walked in a process pool, see _pool_size.
+
+    budget is checked between tiles, and while waiting for the pool;
+    once it runs out, no more tiles are walked and the paths closed so
+    far are returned, the chains still open across seams are dropped.
+    """
+    workers = _pool_size(workers)
+    h, w = data.shape
+    tiles = [
+        (r0, c0, min(tilesize, h + 1 - r0), min(tilesize, w + 1 - c0))
+        for r0 in range(0, h + 1, tilesize)
+        for c0 in range(0, w + 1, tilesize)
+    ]
+    plist = []
+    by_start = {}
+    by_end = {}
+    found = 0  # /* points of the paths in plist, see _out_of_budget */
+
+    def close(pts):
+        nonlocal found
+        path = _cycle_to_path(pts[0] if len(pts) == 1 else np.concatenate(pts))
         if path.area > turdsize:
             plist.append(path)
+            found += len(path)
+
+    def stitch(chain):
+        pred = by_end.pop(chain.start, None)
+        if pred is not None:
+            del by_start[pred.start]
+            pred.pts.extend(chain.pts)
+            pred.end = chain.end
+            chain = pred
+        if chain.start == chain.end:
+            close(chain.pts)
+            return
+        succ = by_start.pop(chain.end, None)
+        if succ is not None:
+            del by_end[succ.end]
+            chain.pts.extend(succ.pts)
+            chain.end = succ.end
+        if chain.start == chain.end:
+            close(chain.pts)
+            return
+        by_start[chain.start] = chain
+        by_end[chain.end] = chain
+
+    def collect(result):
+        cycles, chains = result
+        for pt in cycles:
+            close([pt])
+        for pt, start, end in chains:
+            stitch(_Chain(pt, start, end))
+
+    def finish(job) -> bool:
+        """collect the result of job, unless budget runs out while waiting"""
+        while budget is not None and not job.done():
+            wait([job], timeout=POOL_POLL)
+            if not job.done() and _out_of_budget(budget, found):
+                return False
+        collect(job.result())
+        return True
 
-    # pathlist_to_tree(plist, original)
+    expired = False
+    if workers > 1 and len(tiles) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            jobs = []
+            for r0, c0, rows, cols in tiles:
+                expired = _out_of_budget(budget, found)
+                if expired:
+                    break
+                px = _tile_pixels(data, r0, r0 + rows, c0, c0 + cols)
+                jobs.append(pool.submit(_walk_tile, px, r0, c0, rows, cols, turnpolicy))
+                # /* keep a bounded number of tiles in flight */
+                while len(jobs) > 2 * workers and not expired:
+                    expired = not finish(jobs.pop(0))
+                if expired:
+                    break
+            while jobs and not expired:
+                expired = not finish(jobs.pop(0))
+        finally:
+            # /* don't wait for the tiles started before the budget ran out */
+            pool.shutdown(wait=not expired, cancel_futures=expired)
+    else:
+        for r0, c0, rows, cols in tiles:
+            expired = _out_of_budget(budget, found)
+            if expired:
+                break
+            collect(_trace_tile(data, r0, c0, rows, cols, turnpolicy))
+    if by_start and not expired:
+        raise ValueError("unmatched boundary chains after stitching")
+
+    # /* the order in which bm_to_pathlist finds the paths */
+    plist.sort(key=lambda p: (-p.pt.item(0, 1), p.pt.item(0, 0)))
     return plist
 
 
@@ -952,11 +2021,14 @@ def pointslope(pp: _Path, i: int, j: int, ctr: _Point, dir: _Point) -> None:
         i += n
         r += 1
 
-    x = sums[j + 1].x - sums[i].x + r * sums[n].x
-    y = sums[j + 1].y - sums[i].y + r * sums[n].y
-    x2 = sums[j + 1].x2 - sums[i].x2 + r * sums[n].x2
-    xy = sums[j + 1].xy - sums[i].xy + r * sums[n].xy
-    y2 = sums[j + 1].y2 - sums[i].y2 + r * sums[n].y2
+    sj = sums[j + 1].tolist()
+    si = sums[i].tolist()
+    sn = sums[n].tolist()
+    x = sj[0] - si[0] + r * sn[0]
+    y = sj[1] - si[1] + r * sn[1]
+    x2 = sj[2] - si[2] + r * sn[2]
+    xy = sj[3] - si[3] + r * sn[3]
+    y2 = sj[4] - si[4] + r * sn[4]
     k = j + 1 - i + r * n
 
     ctr.x = x / k
@@ -1147,26 +2219,17 @@ def _calc_sums(path: _Path) -> int:
     rapid summing). Return 0 on success, 1 with errno set on
     failure."""
     n = len(path)
-    path._sums = [_Sums() for i in range(len(path) + 1)]
 
     # origin
-    path._x0 = path.pt[0].x
-    path._y0 = path.pt[0].y
-
-    # /* preparatory computation for later fast summing */
-    path._sums[0].x2 = 0
-    path._sums[0].xy = 0
-    path._sums[0].y2 = 0
-    path._sums[0].x = 0
-    path._sums[0].y = 0
-    for i in range(n):
-        x = path.pt[i].x - path._x0
-        y = path.pt[i].y - path._y0
-        path._sums[i + 1].x = path._sums[i].x + x
-        path._sums[i + 1].y = path._sums[i].y + y
-        path._sums[i + 1].x2 = path._sums[i].x2 + float(x * x)
-        path._sums[i + 1].xy = path._sums[i].xy + float(x * y)
-        path._sums[i + 1].y2 = path._sums[i].y2 + float(y * y)
+    path._x0 = path.pt.item(0, 0)
+    path._y0 = path.pt.item(0, 1)
+
+    # /* preparatory computation for later fast summing: sums[i] holds the
+    # sums of x, y, x*x, x*y, y*y over the points before i */
+    x = (path.pt[:, 0] - path._x0).astype(np.float64)
+    y = (path.pt[:, 1] - path._y0).astype(np.float64)
+    path._sums = np.zeros((n + 1, 5))
+    np.cumsum(np.column_stack((x, y, x * x, x * y, y * y)), axis=0, out=path._sums[1:])
     return 0
 
 
@@ -1181,7 +2244,12 @@ def _calc_lon(pp: _Path) -> int:
         returns 0 on success, 1 on error with errno set
     """
 
-    pt = pp.pt
+    if _jit is not None:
+        pp._lon = _jit.calc_lon(pp.pt).tolist()
+        return 0
+
+    xs = pp.pt[:, 0].tolist()
+    ys = pp.pt[:, 1].tolist()
     n = len(pp)
     ct = [0, 0, 0, 0]
     pivk = [None] * n  # pivk[n]
@@ -1189,7 +2257,7 @@ def _calc_lon(pp: _Path) -> int:
 
     k = 0
     for i in range(n - 1, -1, -1):
-        if pt[i].x != pt[k].x and pt[i].y != pt[k].y:
+        if xs[i] != xs[k] and ys[i] != ys[k]:
             k = i + 1  # /* necessarily i<n-1 in this case */
         nc[i] = k
 
@@ -1203,7 +2271,7 @@ def _calc_lon(pp: _Path) -> int:
 
         # keep track of "directions" that have occurred
         dir = int(
-            (3 + 3 * (pt[mod(i + 1, n)].x - pt[i].x) + (pt[mod(i + 1, n)].y - pt[i].y))
+            (3 + 3 * (xs[mod(i + 1, n)] - xs[i]) + (ys[mod(i + 1, n)] - ys[i]))
             // 2
         )
         ct[dir] += 1
@@ -1218,7 +2286,7 @@ def _calc_lon(pp: _Path) -> int:
         k1 = i
         while True:
             break_inner_loop_and_continue = False
-            dir = int(3 + 3 * sign(pt[k].x - pt[k1].x) + sign(pt[k].y - pt[k1].y)) // 2
+            dir = int(3 + 3 * sign(xs[k] - xs[k1]) + sign(ys[k] - ys[k1])) // 2
             ct[dir] += 1
 
             # if all four "directions" have occurred, cut this path
@@ -1227,8 +2295,8 @@ def _calc_lon(pp: _Path) -> int:
                 break_inner_loop_and_continue = True
                 break  # goto foundk;
 
-            cur_x = pt[k].x - pt[i].x
-            cur_y = pt[k].y - pt[i].y
+            cur_x = xs[k] - xs[i]
+            cur_y = ys[k] - ys[i]
 
             if (
                 xprod(constraint0x, constraint0y, cur_x, cur_y) < 0
@@ -1262,10 +2330,10 @@ def _calc_lon(pp: _Path) -> int:
         k is the first one violating it. We now need to find the last
         point along k1..k which satisfied the constraint."""
         # dk: direction of k-k1
-        dk_x = sign(pt[k].x - pt[k1].x)
-        dk_y = sign(pt[k].y - pt[k1].y)
-        cur_x = pt[k1].x - pt[i].x
-        cur_y = pt[k1].y - pt[i].y
+        dk_x = sign(xs[k] - xs[k1])
+        dk_y = sign(ys[k] - ys[k1])
+        cur_x = xs[k1] - xs[i]
+        cur_y = ys[k1] - ys[i]
         """find largest integer j such that xprod(constraint[0], cur+j*dk) >= 0 
         and xprod(constraint[1], cur+j*dk) <= 0. Use bilinearity of xprod. */"""
         a = xprod(constraint0x, constraint0y, cur_x, cur_y)
@@ -1321,25 +2389,30 @@ def penalty3(pp: _Path, i: int, j: int) -> float:
         r = 1
 
     # /* critical inner loop: the "if" gives a 4.6 percent speedup */
+    sj = sums[j + 1].tolist()
+    si = sums[i].tolist()
     if r == 0:
-        x = sums[j + 1].x - sums[i].x
-        y = sums[j + 1].y - sums[i].y
-        x2 = sums[j + 1].x2 - sums[i].x2
-        xy = sums[j + 1].xy - sums[i].xy
-        y2 = sums[j + 1].y2 - sums[i].y2
+        x = sj[0] - si[0]
+        y = sj[1] - si[1]
+        x2 = sj[2] - si[2]
+        xy = sj[3] - si[3]
+        y2 = sj[4] - si[4]
         k = j + 1 - i
     else:
-        x = sums[j + 1].x - sums[i].x + sums[n].x
-        y = sums[j + 1].y - sums[i].y + sums[n].y
-        x2 = sums[j + 1].x2 - sums[i].x2 + sums[n].x2
-        xy = sums[j + 1].xy - sums[i].xy + sums[n].xy
-        y2 = sums[j + 1].y2 - sums[i].y2 + sums[n].y2
+        sn = sums[n].tolist()
+        x = sj[0] - si[0] + sn[0]
+        y = sj[1] - si[1] + sn[1]
+        x2 = sj[2] - si[2] + sn[2]
+        xy = sj[3] - si[3] + sn[3]
+        y2 = sj[4] - si[4] + sn[4]
         k = j + 1 - i + n
 
-    px = (pt[i].x + pt[j].x) / 2.0 - pt[0].x
-    py = (pt[i].y + pt[j].y) / 2.0 - pt[0].y
-    ey = pt[j].x - pt[i].x
-    ex = -(pt[j].y - pt[i].y)
+    xi, yi = pt[i].tolist()
+    xj, yj = pt[j].tolist()
+    px = (xi + xj) / 2.0 - pp._x0
+    py = (yi + yj) / 2.0 - pp._y0
+    ey = xj - xi
+    ex = -(yj - yi)
 
     a = (x2 - 2 * x * px) / k + px * px
     b = (xy - x * py - y * px) / k + px * py
@@ -1349,12 +2422,56 @@ def penalty3(pp: _Path, i: int, j: int) -> float:
     return math.sqrt(s)
 
 
+def penalty3_batch(
+    pp: _Path, i: np.ndarray, j: np.ndarray, ptf: np.ndarray
+) -> np.ndarray:
+    """Batched penalty3: the penalties of the edges from i[q] to j[q], for
+    all q at once, computed with the same floating point operations as
+    penalty3 so the results are identical. ptf is pp.pt as float64."""
+    n = len(pp)
+    sums = pp._sums
+
+    # /* assume 0<=i<j<=n    */
+
+    r = j >= n  # /* rotations from i to j */
+    j = np.where(r, j - n, j)
+
+    d = sums[j + 1] - sums[i]
+    d[r] += sums[n]
+    k = j + 1 - i + n * r
+    x, y, x2, xy, y2 = d.T
+
+    xi, yi = ptf[i].T
+    xj, yj = ptf[j].T
+    px = (xi + xj) / 2.0 - pp._x0
+    py = (yi + yj) / 2.0 - pp._y0
+    ey = xj - xi
+    ex = -(yj - yi)
+
+    a = (x2 - 2 * x * px) / k + px * px
+    b = (xy - x * py - y * px) / k + px * py
+    c = (y2 - 2 * y * py) / k + py * py
+
+    s = ex * ex * a + 2 * ex * ey * b + ey * ey * c
+    return np.sqrt(s)
+
+
+# /* maximum number of candidate edges evaluated by one penalty3_batch call */
+BESTPOLYGON_CHUNK = 1 << 16
+
+
 def _bestpolygon(pp: _Path) -> int:
     """
     /* find the optimal polygon. Fill in the m and po components. Return 1
          on failure with errno set, else 0. Non-cyclic version: assumes i=0
          is in the polygon. Fixme: implement cyclic version. */
     """
+    if _jit is not None:
+        po = _jit.bestpolygon(pp.pt, np.asarray(pp._lon), pp._sums, pp._x0, pp._y0)
+        pp._po = po.tolist()
+        pp._m = len(pp._po)
+        return 0
+
     n = len(pp)
     pen = [None] * (n + 1)  # /* pen[n+1]: penalty vector */
     prev = [None] * (n + 1)  # /* prev[n+1]: best path pointer vector */
@@ -1403,16 +2520,42 @@ def _bestpolygon(pp: _Path) -> int:
          the worst-case behavior here is quadratic. In practice, it is
          close to linear since the inner loop tends to be short. */
          """
+    """The penalty of an edge does not depend on the search, so the
+    candidate edges (k, i) are enumerated up front - i runs through
+    seg1[j]..seg0[j] for j = 1..m, k from seg0[j-1] down to clip1[i] -
+    and their penalties are computed in batches. The search itself then
+    only adds and compares."""
+    width = np.array(seg0[1 : m + 1]) - np.array(seg1[1 : m + 1]) + 1
+    first = np.cumsum(width) - width
+    ii = np.repeat(seg1[1 : m + 1], width) + np.arange(width.sum()) - np.repeat(
+        first, width
+    )
+    hi = np.repeat(seg0[:m], width)
+    clip1[0] = 0
+    cnt = np.maximum(hi - np.array(clip1)[ii] + 1, 0)
+    ends = np.cumsum(cnt)
+    ptf = pp.pt.astype(np.float64)
+
     pen[0] = 0
-    for j in range(1, m + 1):
-        for i in range(seg1[j], seg0[j] + 1):
+    a = 0
+    while a < len(ii):
+        # /* next chunk: as many i as fit into BESTPOLYGON_CHUNK edges */
+        b = max(int(np.searchsorted(ends, ends[a] - cnt[a] + BESTPOLYGON_CHUNK)), a + 1)
+        c = cnt[a:b]
+        kk = np.repeat(hi[a:b], c) - np.arange(c.sum()) + np.repeat(np.cumsum(c) - c, c)
+        p3 = penalty3_batch(pp, kk, np.repeat(ii[a:b], c), ptf).tolist()
+        kk = kk.tolist()
+        q0 = 0
+        for i, ci in zip(ii[a:b].tolist(), c.tolist()):
             best = -1
-            for k in range(seg0[j - 1], clip1[i] - 1, -1):
-                thispen = penalty3(pp, k, i) + pen[k]
+            for q in range(q0, q0 + ci):
+                thispen = p3[q] + pen[kk[q]]
                 if best < 0 or thispen < best:
-                    prev[i] = k
+                    prev[i] = kk[q]
                     best = thispen
             pen[i] = best
+            q0 += ci
+        a = b
 
     pp._m = m
     pp._po = [None] * m
@@ -1441,141 +2584,252 @@ def _adjust_vertices(pp: _Path) -> int:
      if it lies outside. Return 1 with errno set on error; 0 on
      success. */
     """
-    m = pp._m
-    po = pp._po
-    n = len(pp)
-    pt = pp.pt  # point_t
-    x0 = pp._x0
-    y0 = pp._y0
-
-    ctr = [_Point() for i in range(m)]  # /* ctr[m] */
-    dir = [_Point() for i in range(m)]  # /* dir[m] */
-    q = [
-        [[0.0 for a in range(3)] for b in range(3)] for c in range(m)
-    ]  # quadform_t/* q[m] */
-    v = [0.0, 0.0, 0.0]
-    s = _Point(0, 0)
-    pp._curve = _Curve(m)
+    return _adjust_vertices_batch([pp])
 
-    # /* calculate "optimal" point-slope representation for each line segment */
-    for i in range(m):
-        j = po[mod(i + 1, m)]
-        j = mod(j - po[i], n) + po[i]
-        pointslope(pp, po[i], j, ctr[i], dir[i])
 
-        # /* represent each line segment as a singular quadratic form;
-        # the distance of a point (x,y) from the line segment will be
-        # (x,y,1)Q(x,y,1)^t, where Q=q[i]. */
-    for i in range(m):
-        d = sq(dir[i].x) + sq(dir[i].y)
-        if d == 0.0:
-            for j in range(3):
-                for k in range(3):
-                    q[i][j][k] = 0
-        else:
-            v[0] = dir[i].y
-            v[1] = -dir[i].x
-            v[2] = -v[1] * ctr[i].y - v[0] * ctr[i].x
-            for l in range(3):
-                for k in range(3):
-                    q[i][l][k] = v[l] * v[k] / d
-
-    """/* now calculate the "intersections" of consecutive segments.
-         Instead of using the actual intersection, we find the point
-         within a given unit square which minimizes the square distance to
-         the two lines. */"""
-    Q = [[0.0 for a in range(3)] for b in range(3)]
-    for i in range(m):
-        # double min, cand; #/* minimum and candidate for minimum of quad. form */
-        # double xmin, ymin;	#/* coordinates of minimum */
+def _adjust_vertices_batch(plist: list) -> int:
+    """
+    _adjust_vertices for every path of plist at once. The vertices of all
+    polygons are stacked into arrays (one row per vertex) and go through
+    the same floating point operations, in the same order, as in the
+    vertex by vertex version, so the results are identical. Only the rare
+    vertices whose quadratic form is singular are finished one at a time
+    by _adjust_vertex.
+    """
+    ms = [pp._m for pp in plist]
+    offsets = np.zeros(len(plist) + 1, dtype=np.intp)
+    np.cumsum(ms, out=offsets[1:])
+    if offsets[-1] == 0:
+        for pp in plist:
+            pp._curve = _Curve(pp._m)
+        return 0
 
-        # /* let s be the vertex, in coordinates relative to x0/y0 */
-        s.x = pt[po[i]].x - x0
-        s.y = pt[po[i]].y - y0
+    # /* per vertex: sums at i, j+1 and n, rotations r, length k, and the
+    # polygon vertex s relative to the sums origin */
+    si, sj, sn, rot, kk, sv, org = [], [], [], [], [], [], []
+    for pp in plist:
+        if not pp._m:
+            continue
+        n = len(pp)
+        po = np.array(pp._po, dtype=np.intp)
+        j = (np.roll(po, -1) - po) % n + po
+        r = j >= n
+        j[r] -= n
+        sums = pp._sums
+        si.append(sums[po])
+        sj.append(sums[j + 1])
+        sn.append(np.broadcast_to(sums[n], (len(po), 5)))
+        rot.append(r)
+        kk.append(j + 1 - po + r * n)
+        origin = (pp._x0, pp._y0)
+        sv.append(pp.pt[po] - origin)
+        org.append(np.broadcast_to(origin, (len(po), 2)))
+    si = np.concatenate(si)
+    sj = np.concatenate(sj)
+    sn = np.concatenate(sn)
+    r = np.concatenate(rot).astype(float)
+    k = np.concatenate(kk)
+    sv = np.concatenate(sv).astype(np.int64)
+    org = np.concatenate(org)
+
+    # /* calculate "optimal" point-slope representation for each line
+    # segment, as in pointslope() */
+    x = sj[:, 0] - si[:, 0] + r * sn[:, 0]
+    y = sj[:, 1] - si[:, 1] + r * sn[:, 1]
+    x2 = sj[:, 2] - si[:, 2] + r * sn[:, 2]
+    xy = sj[:, 3] - si[:, 3] + r * sn[:, 3]
+    y2 = sj[:, 4] - si[:, 4] + r * sn[:, 4]
+    ctrx = x / k
+    ctry = y / k
+    a = (x2 - x * x / k) / k
+    b = (xy - x * y / k) / k
+    c = (y2 - y * y / k) / k
+    lambda2 = (a + c + np.sqrt((a - c) * (a - c) + 4 * b * b)) / 2
+    a -= lambda2
+    c -= lambda2
+    first = np.fabs(a) >= np.fabs(c)
+    l = np.where(first, np.sqrt(a * a + b * b), np.sqrt(c * c + b * b))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dirx = np.where(l != 0, np.where(first, -b, -c) / l, 0.0)
+        diry = np.where(l != 0, np.where(first, a, b) / l, 0.0)
+
+    # /* represent each line segment as a singular quadratic form */
+    d = dirx * dirx + diry * diry
+    v = np.stack((diry, -dirx, -(-dirx) * ctry - diry * ctrx), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        q = np.where(
+            (d != 0.0)[:, None, None], v[:, :, None] * v[:, None, :] / d[:, None, None], 0.0
+        )
 
-        # /* intersect segments i-1 and i */
+    # /* add the quadratic forms of segments i-1 and i */
+    prev = np.arange(-1, offsets[-1] - 1)
+    prev[offsets[:-1][np.diff(offsets) > 0]] = offsets[1:][np.diff(offsets) > 0] - 1
+    Q = q[prev] + q
+
+    # /* find intersection */
+    det = Q[:, 0, 0] * Q[:, 1, 1] - Q[:, 0, 1] * Q[:, 1, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wx = (-Q[:, 0, 2] * Q[:, 1, 1] + Q[:, 1, 2] * Q[:, 0, 1]) / det
+        wy = (Q[:, 0, 2] * Q[:, 1, 0] - Q[:, 1, 2] * Q[:, 0, 0]) / det
+    sx = sv[:, 0]
+    sy = sv[:, 1]
+    xmin = np.where(det != 0.0, wx, 0.0)
+    ymin = np.where(det != 0.0, wy, 0.0)
+    inside = (np.fabs(wx - sx) <= 0.5) & (np.fabs(wy - sy) <= 0.5)
+
+    # /* the minimum was not in the unit square; now minimize quadratic
+    # on boundary of square */
+    out = np.flatnonzero((det != 0.0) & ~inside)
+    if len(out):
+        Qo = Q[out]
+        sxo = sx[out]
+        syo = sy[out]
+        cx = [sxo.astype(float)]
+        cy = [syo.astype(float)]
+        ok = [np.ones(len(out), dtype=bool)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for z in range(2):  # /* value of the y-coordinate */
+                py = syo - 0.5 + z
+                px = -(Qo[:, 0, 1] * py + Qo[:, 0, 2]) / Qo[:, 0, 0]
+                cx.append(px)
+                cy.append(py)
+                ok.append((Qo[:, 0, 0] != 0.0) & (np.fabs(px - sxo) <= 0.5))
+            for z in range(2):  # /* value of the x-coordinate */
+                px = sxo - 0.5 + z
+                py = -(Qo[:, 1, 0] * px + Qo[:, 1, 2]) / Qo[:, 1, 1]
+                cx.append(px)
+                cy.append(py)
+                ok.append((Qo[:, 1, 1] != 0.0) & (np.fabs(py - syo) <= 0.5))
+        for l in range(2):  # /* check four corners */
+            for kc in range(2):
+                cx.append(sxo - 0.5 + l)
+                cy.append(syo - 0.5 + kc)
+                ok.append(np.ones(len(out), dtype=bool))
+        cx = np.stack(cx, axis=1)
+        cy = np.stack(cy, axis=1)
+        cand = _quadform_batch(Qo, cx, cy)
+        # /* first strict minimum, as the sequential scan finds it: skipped
+        # and NaN candidates never win, a NaN start value is never beaten */
+        nanstart = np.isnan(cand[:, 0])
+        cand[~np.stack(ok, axis=1) | np.isnan(cand)] = np.inf
+        cand[nanstart, 0] = -np.inf
+        best = np.argmin(cand, axis=1)
+        rows = np.arange(len(out))
+        xmin[out] = cx[rows, best]
+        ymin[out] = cy[rows, best]
+        # /* where the vertex itself won, it stays integer as in the C code */
+        keep = out[best == 0].tolist()
+    else:
+        keep = []
+
+    vx = (xmin + org[:, 0]).tolist()
+    vy = (ymin + org[:, 1]).tolist()
+    for i in keep:
+        vx[i] = sx.item(i) + org.item(i, 0)
+        vy[i] = sy.item(i) + org.item(i, 1)
+
+    # /* the singular case, one vertex at a time */
+    for i in np.flatnonzero(det == 0.0).tolist():
+        x, y = _adjust_vertex(Q[i].tolist(), sx.item(i), sy.item(i))
+        vx[i] = x + org.item(i, 0)
+        vy[i] = y + org.item(i, 1)
+
+    for pp, a, b in zip(plist, offsets[:-1].tolist(), offsets[1:].tolist()):
+        pp._curve = _Curve(b - a)
+        for seg, x, y in zip(pp._curve.segments, vx[a:b], vy[a:b]):
+            seg.vertex.x = x
+            seg.vertex.y = y
+    return 0
 
-        j = mod(i - 1, m)
 
-        # /* add quadratic forms */
-        for l in range(3):
-            for k in range(3):
-                Q[l][k] = q[j][l][k] + q[i][l][k]
+def _quadform_batch(Q: np.ndarray, wx: np.ndarray, wy: np.ndarray) -> np.ndarray:
+    """quadform(Q[r], (wx[r, c], wy[r, c])) for every row r and column c"""
+    v = (wx, wy, np.ones_like(wx))
+    sum = np.zeros_like(wx)
+    for i in range(3):
+        for j in range(3):
+            sum = sum + v[i] * Q[:, i, j, None] * v[j]
+    return sum
 
-        while True:
-            # /* minimize the quadratic form Q on the unit square */
-            # /* find intersection */
-
-            det = Q[0][0] * Q[1][1] - Q[0][1] * Q[1][0]
-            w = None
-            if det != 0.0:
-                w = _Point(
-                    (-Q[0][2] * Q[1][1] + Q[1][2] * Q[0][1]) / det,
-                    (Q[0][2] * Q[1][0] - Q[1][2] * Q[0][0]) / det,
-                )
-                break
 
-            # /* matrix is singular - lines are parallel. Add another,
-            # orthogonal axis, through the center of the unit square */
-            if Q[0][0] > Q[1][1]:
-                v[0] = -Q[0][1]
-                v[1] = Q[0][0]
-            elif Q[1][1]:
-                v[0] = -Q[1][1]
-                v[1] = Q[1][0]
-            else:
-                v[0] = 1
-                v[1] = 0
-            d = sq(v[0]) + sq(v[1])
-            v[2] = -v[1] * s.y - v[0] * s.x
-            for l in range(3):
-                for k in range(3):
-                    Q[l][k] += v[l] * v[k] / d
-        dx = math.fabs(w.x - s.x)
-        dy = math.fabs(w.y - s.y)
-        if dx <= 0.5 and dy <= 0.5:
-            pp._curve[i].vertex.x = w.x + x0
-            pp._curve[i].vertex.y = w.y + y0
-            continue
-
-        # /* the minimum was not in the unit square; now minimize quadratic
-        # on boundary of square */
-        min = quadform(Q, s)
-        xmin = s.x
-        ymin = s.y
+def _adjust_vertex(Q: list, sx: int, sy: int) -> Tuple[float, float]:
+    """
+    the point of the unit square around (sx,sy) minimizing the quadratic
+    form Q, for a Q that may be singular; in coordinates relative to the
+    sums origin.
+    """
+    v = [0.0, 0.0, 0.0]
+    s = _Point(sx, sy)
+    while True:
+        # /* minimize the quadratic form Q on the unit square */
+        # /* find intersection */
+
+        det = Q[0][0] * Q[1][1] - Q[0][1] * Q[1][0]
+        w = None
+        if det != 0.0:
+            w = _Point(
+                (-Q[0][2] * Q[1][1] + Q[1][2] * Q[0][1]) / det,
+                (Q[0][2] * Q[1][0] - Q[1][2] * Q[0][0]) / det,
+            )
+            break
 
-        if Q[0][0] != 0.0:
-            for z in range(2):  # /* value of the y-coordinate */
-                w.y = s.y - 0.5 + z
-                w.x = -(Q[0][1] * w.y + Q[0][2]) / Q[0][0]
-                dx = math.fabs(w.x - s.x)
-                cand = quadform(Q, w)
-                if dx <= 0.5 and cand < min:
-                    min = cand
-                    xmin = w.x
-                    ymin = w.y
-        if Q[1][1] != 0.0:
-            for z in range(2):  # /* value of the x-coordinate */
-                w.x = s.x - 0.5 + z
-                w.y = -(Q[1][0] * w.x + Q[1][2]) / Q[1][1]
-                dy = math.fabs(w.y - s.y)
-                cand = quadform(Q, w)
-                if dy <= 0.5 and cand < min:
-                    min = cand
-                    xmin = w.x
-                    ymin = w.y
-        # /* check four corners */
-        for l in range(2):
-            for k in range(2):
-                w = _Point(s.x - 0.5 + l, s.y - 0.5 + k)
-                cand = quadform(Q, w)
-                if cand < min:
-                    min = cand
-                    xmin = w.x
-                    ymin = w.y
-        pp._curve[i].vertex.x = xmin + x0
-        pp._curve[i].vertex.y = ymin + y0
-    return 0
+        # /* matrix is singular - lines are parallel. Add another,
+        # orthogonal axis, through the center of the unit square */
+        if Q[0][0] > Q[1][1]:
+            v[0] = -Q[0][1]
+            v[1] = Q[0][0]
+        elif Q[1][1]:
+            v[0] = -Q[1][1]
+            v[1] = Q[1][0]
+        else:
+            v[0] = 1
+            v[1] = 0
+        d = sq(v[0]) + sq(v[1])
+        v[2] = -v[1] * s.y - v[0] * s.x
+        for l in range(3):
+            for k in range(3):
+                Q[l][k] += v[l] * v[k] / d
+    dx = math.fabs(w.x - s.x)
+    dy = math.fabs(w.y - s.y)
+    if dx <= 0.5 and dy <= 0.5:
+        return w.x, w.y
+
+    # /* the minimum was not in the unit square; now minimize quadratic
+    # on boundary of square */
+    min = quadform(Q, s)
+    xmin = s.x
+    ymin = s.y
+
+    if Q[0][0] != 0.0:
+        for z in range(2):  # /* value of the y-coordinate */
+            w.y = s.y - 0.5 + z
+            w.x = -(Q[0][1] * w.y + Q[0][2]) / Q[0][0]
+            dx = math.fabs(w.x - s.x)
+            cand = quadform(Q, w)
+            if dx <= 0.5 and cand < min:
+                min = cand
+                xmin = w.x
+                ymin = w.y
+    if Q[1][1] != 0.0:
+        for z in range(2):  # /* value of the x-coordinate */
+            w.x = s.x - 0.5 + z
+            w.y = -(Q[1][0] * w.x + Q[1][2]) / Q[1][1]
+            dy = math.fabs(w.y - s.y)
+            cand = quadform(Q, w)
+            if dy <= 0.5 and cand < min:
+                min = cand
+                xmin = w.x
+                ymin = w.y
+    # /* check four corners */
+    for l in range(2):
+        for k in range(2):
+            w = _Point(s.x - 0.5 + l, s.y - 0.5 + k)
+            cand = quadform(Q, w)
+            if cand < min:
+                min = cand
+                xmin = w.x
+                ymin = w.y
+    return xmin, ymin
 
 
 """
@@ -1601,42 +2855,80 @@ def reverse(curve: _Curve) -> None:
 
 
 def _smooth(curve: _Curve, alphamax: float) -> None:
-    m = curve.n
+    _smooth_batch([curve], alphamax)
 
-    # /* examine each vertex and find its best fit */
-    for i in range(m):
-        j = mod(i + 1, m)
-        k = mod(i + 2, m)
-        p4 = interval(1 / 2.0, curve[k].vertex, curve[j].vertex)
-
-        denom = ddenom(curve[i].vertex, curve[k].vertex)
-        if denom != 0.0:
-            dd = dpara(curve[i].vertex, curve[j].vertex, curve[k].vertex) / denom
-            dd = math.fabs(dd)
-            alpha = (1 - 1.0 / dd) if dd > 1 else 0
-            alpha = alpha / 0.75
-        else:
-            alpha = 4 / 3.0
-        curve[j].alpha0 = alpha  # /* remember "original" value of alpha */
 
-        if alpha >= alphamax:  # /* pointed corner */
-            curve[j].tag = POTRACE_CORNER
-            curve[j].c[1] = curve[j].vertex
-            curve[j].c[2] = p4
-        else:
-            if alpha < 0.55:
-                alpha = 0.55
-            elif alpha > 1:
-                alpha = 1
-            p2 = interval(0.5 + 0.5 * alpha, curve[i].vertex, curve[j].vertex)
-            p3 = interval(0.5 + 0.5 * alpha, curve[k].vertex, curve[j].vertex)
-            curve[j].tag = POTRACE_CURVETO
-            curve[j].c[0] = p2
-            curve[j].c[1] = p3
-            curve[j].c[2] = p4
-        curve[j].alpha = alpha  # /* store the "cropped" value of alpha */
-        curve[j].beta = 0.5
-    curve.alphacurve = True
+def _smooth_batch(curves: list, alphamax: float) -> None:
+    """
+    _smooth for every curve of curves at once: alpha and the corner
+    classification are computed for all vertices as arrays, with the
+    same floating point operations as the vertex by vertex version.
+    """
+    ms = [curve.n for curve in curves]
+    offsets = np.zeros(len(curves) + 1, dtype=np.intp)
+    np.cumsum(ms, out=offsets[1:])
+    total = int(offsets[-1])
+    vertex = [seg.vertex for curve in curves for seg in curve.segments]
+    if total:
+        V = np.array([(p.x, p.y) for p in vertex], dtype=float)
+    else:
+        V = np.zeros((0, 2))
+
+    # /* vertex i and the two following it on the same curve */
+    start = np.repeat(offsets[:-1], ms)
+    m = np.repeat(ms, ms)
+    local = np.arange(total) - start
+    i = V
+    j = V[start + (local + 1) % np.maximum(m, 1)]
+    k = V[start + (local + 2) % np.maximum(m, 1)]
+
+    # /* p4 = interval(1/2, k, j) */
+    p4 = k + 0.5 * (j - k)
+
+    # /* denom = ddenom(i, k) */
+    rx = -np.sign(k[:, 1] - i[:, 1])
+    ry = np.sign(k[:, 0] - i[:, 0])
+    denom = ry * (k[:, 0] - i[:, 0]) - rx * (k[:, 1] - i[:, 1])
+    # /* dpara(i, j, k) */
+    dpara = (j[:, 0] - i[:, 0]) * (k[:, 1] - i[:, 1]) - (k[:, 0] - i[:, 0]) * (
+        j[:, 1] - i[:, 1]
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dd = np.fabs(dpara / denom)
+        alpha = np.where(dd > 1, 1 - 1.0 / dd, 0.0) / 0.75
+    alpha = np.where(denom != 0.0, alpha, 4 / 3.0)
+    corner = alpha >= alphamax
+    cropped = np.clip(alpha, 0.55, 1)
+    t = 0.5 + 0.5 * cropped
+    p2 = i + t[:, None] * (j - i)
+    p3 = k + t[:, None] * (j - k)
+
+    # /* the values belong to vertex j */
+    alpha = alpha.tolist()
+    cropped = cropped.tolist()
+    corner = corner.tolist()
+    p2 = p2.tolist()
+    p3 = p3.tolist()
+    p4 = p4.tolist()
+    for curve, a, b in zip(curves, offsets[:-1].tolist(), offsets[1:].tolist()):
+        segments = curve.segments
+        n = b - a
+        for q in range(a, b):
+            seg = segments[(q - a + 1) % n]
+            seg.alpha0 = alpha[q]  # /* remember "original" value of alpha */
+            if corner[q]:  # /* pointed corner */
+                seg.tag = POTRACE_CORNER
+                seg.c[1] = seg.vertex
+                seg.c[2] = _Point(*p4[q])
+                seg.alpha = alpha[q]
+            else:
+                seg.tag = POTRACE_CURVETO
+                seg.c[0] = _Point(*p2[q])
+                seg.c[1] = _Point(*p3[q])
+                seg.c[2] = _Point(*p4[q])
+                seg.alpha = 1 if cropped[q] == 1 and alpha[q] > 1 else cropped[q]
+            seg.beta = 0.5
+        curve.alphacurve = True
 
 
 """
@@ -1746,6 +3038,8 @@ def opti_penalty(
         return 1
 
     R = area / A  # /* relative area */
+    if 4 - R / 0.3 < 0:  # /* no alpha encloses that much area */
+        return 1
     alpha = 2 - math.sqrt(4 - R / 0.3)  # /* overall alpha for p0-o-p3 curve */
 
     res.c[0] = interval(t * alpha, p0, p1)
@@ -1919,36 +3213,802 @@ def _opticurve(pp: _Path, opttolerance: float) -> int:
     return 0
 
 
+def _opti_tangents(p0, p1, p2, p3, e):
+    """
+    tangent() and bezier() for arrays: the parameter t at which each
+    curve (p0,p1,p2,p3) is tangent to the direction e, or -1.0 if there
+    is no solution in [0..1], and the point of the curve at t. Points
+    are (x, y) pairs of arrays that broadcast against each other.
+    """
+    A = (p1[0] - p0[0]) * e[1] - e[0] * (p1[1] - p0[1])
+    B = (p2[0] - p1[0]) * e[1] - e[0] * (p2[1] - p1[1])
+    C = (p3[0] - p2[0]) * e[1] - e[0] * (p3[1] - p2[1])
+
+    a = A - 2 * B + C
+    b = -2 * A + 2 * B
+    c = A
+
+    d = b * b - 4 * a * c
+    s = np.sqrt(d)
+
+    r1 = (-b + s) / (2 * a)
+    r2 = (-b - s) / (2 * a)
+
+    t = np.where((0 <= r2) & (r2 <= 1), r2, -1.0)
+    t = np.where((0 <= r1) & (r1 <= 1), r1, t)
+    t = np.where((a == 0) | (d < 0), -1.0, t)
+
+    s = 1 - t
+    x = (
+        s * s * s * p0[0]
+        + 3 * (s * s * t) * p1[0]
+        + 3 * (t * t * s) * p2[0]
+        + t * t * t * p3[0]
+    )
+    y = (
+        s * s * s * p0[1]
+        + 3 * (s * s * t) * p1[1]
+        + 3 * (t * t * s) * p2[1]
+        + t * t * t * p3[1]
+    )
+    return t, x, y
+
+
+def _opticurve_batch(plist: list, opttolerance: float) -> int:
+    """
+    _opticurve for every path of plist at once.
+
+    The penalty of merging the segments i+1..j into one is computed for
+    all candidate merges (i, j) of all paths as arrays, one gap j-i at a
+    time: as in the loop over i in potrace, a merge is only tried if all
+    shorter merges ending at j were possible. The convexity, area and
+    edge tables are computed once per batch, the cheap convexity and
+    bend checks prune candidates before any curve is fitted, and the
+    Bezier and tangent checks run over all edges of all remaining
+    candidates together. The floating point operations are those of
+    potrace's opti_penalty, so the result is the same.
+    """
+    ms = np.array([pp._curve.n for pp in plist], dtype=np.intp)
+    offsets = np.zeros(len(plist) + 1, dtype=np.intp)
+    np.cumsum(ms, out=offsets[1:])
+    total = int(offsets[-1])
+    segs = [seg for pp in plist for seg in pp._curve.segments]
+    V = np.array([(seg.vertex.x, seg.vertex.y) for seg in segs], dtype=float)
+    Cp = np.array([(seg.c[2].x, seg.c[2].y) for seg in segs], dtype=float)
+    V = V.reshape(total, 2)
+    Cp = Cp.reshape(total, 2)
+    curveto = np.array([seg.tag == POTRACE_CURVETO for seg in segs], dtype=bool)
+    alpha = np.array([seg.alpha for seg in segs], dtype=float)
+
+    # /* segment k and its neighbours on the same curve */
+    start = np.repeat(offsets[:-1], ms)
+    m = np.maximum(np.repeat(ms, ms), 1)
+    local = np.arange(total) - start
+    nxt = start + (local + 1) % m
+    prv = start + (local - 1) % m
+    vx, vy = V[:, 0], V[:, 1]
+    cx, cy = Cp[:, 0], Cp[:, 1]
+
+    with np.errstate(all="ignore"):
+        # /* edges vertex[k] -> vertex[k+1] and c[2][k] -> c[2][k+1] */
+        evx = vx[nxt] - vx
+        evy = vy[nxt] - vy
+        dx = vx - vx[nxt]
+        dy = vy - vy[nxt]
+        elen = np.sqrt(dx * dx + dy * dy)
+        ecx = cx[nxt] - cx
+        ecy = cy[nxt] - cy
+        dx = cx - cx[nxt]
+        dy = cy - cy[nxt]
+        clen = np.sqrt(dx * dx + dy * dy)
+
+        # /* pre-calculate convexity: +1 = right turn, -1 = left turn, 0 = corner */
+        convc = np.sign(
+            (vx - vx[prv]) * (vy[nxt] - vy[prv]) - (vx[nxt] - vx[prv]) * (vy - vy[prv])
+        )
+        convc = np.where(curveto, convc, 0.0)
+
+        # /* distance of vertex[k+1] from the edge k, scaled by its alpha */
+        d2tab = (ecx * (vy[nxt] - cy) - (vx[nxt] - cx) * ecy) / clen
+        d2tab = d2tab * (0.75 * alpha[nxt])
+
+        # /* pre-calculate areas */
+        a1 = alpha[nxt]
+        t1 = (
+            0.3
+            * a1
+            * (4 - a1)
+            * ((vx[nxt] - cx) * ecy - ecx * (vy[nxt] - cy))
+            / 2
+        )
+        v0x = vx[start]
+        v0y = vy[start]
+        t2 = ((cx - v0x) * (cy[nxt] - v0y) - (cx[nxt] - v0x) * (cy - v0y)) / 2
+        terms = np.where(curveto[nxt, None], np.stack([t1, t2], axis=1), 0.0)
+        terms = terms.ravel()
+    # /* cumarea[m+1] of path p starts at abase[p] */
+    abase = offsets[:-1] + np.arange(len(plist))
+    areac = np.zeros(total + len(plist))
+    for a, b, base in zip(offsets[:-1].tolist(), offsets[1:].tolist(), abase.tolist()):
+        areac[base + 1 : base + 1 + b - a] = np.cumsum(terms[2 * a : 2 * b])[1::2]
+
+    # /* candidates (path, j), starting with i = j - 2 */
+    counts = np.maximum(ms - 1, 0)
+    P = np.repeat(np.arange(len(plist)), counts)
+    J = np.arange(len(P)) - np.repeat(np.cumsum(counts) - counts, counts) + 2
+    tables = (offsets, ms, abase, areac, V, Cp, convc)
+    tables += (evx, evy, elen, ecx, ecy, clen, d2tab)
+    found = {}  # /* (path, j) -> possible merges (i, pen, c0, c1, alpha, t, s) */
+    g = 2
+    while True:
+        I = J - g
+        keep = I >= 0
+        P, J, I = P[keep], J[keep], I[keep]
+        if not len(P):
+            break
+        with np.errstate(all="ignore"):
+            ok = _opti_try(P, J, I, g, tables, opttolerance, found)
+        P, J = P[ok], J[ok]
+        g += 1
+
+    for q, pp in enumerate(plist):
+        _opti_select(pp, q, found)
+    return 0
+
+
+def _opti_try(P, J, I, g: int, tables: tuple, opttolerance: float, found: dict):
+    """
+    try the merges (I, J) of gap g of the paths P, given the tables of
+    _opticurve_batch; record the possible ones in found and return
+    their mask.
+    """
+    offsets, ms, abase, areac, V, Cp, convc = tables[:7]
+    evx, evy, elen, ecx, ecy, clen, d2tab = tables[7:]
+    ok = np.zeros(len(P), dtype=bool)
+    sel = np.arange(len(P))
+    B = offsets[P]
+    M = ms[P]
+    jj = np.where(J == M, 0, J)
+
+    # /* check convexity, corner-freeness, and maximum bend < 179 degrees */
+    gk = B[:, None] + (I[:, None] + np.arange(1, g + 1)) % M[:, None]  # i+1..j
+    gi = B + I
+    conv = convc[gk[:, 0]]
+    good = (I != jj) & (conv != 0) & (convc[gk] == conv[:, None]).all(axis=1)
+    k1 = gk[:, 1:]
+    x1 = evx[gi][:, None]
+    y1 = evy[gi][:, None]
+    good &= (np.sign(x1 * evy[k1] - evx[k1] * y1) == conv[:, None]).all(axis=1)
+    good &= ~(
+        x1 * evx[k1] + y1 * evy[k1] < elen[gi][:, None] * elen[k1] * COS179
+    ).any(axis=1)
+    sel, B, M, I, J, jj, gk, gi = (
+        a[good] for a in (sel, B, M, I, J, jj, gk, gi)
+    )
+
+    # /* the curve we're working in: */
+    gj = B + jj
+    p0 = Cp[gi].T
+    p1 = V[gk[:, 0]].T
+    p2 = V[gj].T
+    p3 = Cp[gj].T
+
+    # /* determine its area */
+    ab = abase[P[sel]]
+    area = areac[ab + jj] - areac[ab + I]
+    v0 = V[B].T
+    area -= ((p0[0] - v0[0]) * (p3[1] - v0[1]) - (p3[0] - v0[0]) * (p0[1] - v0[1])) / 2
+    area = np.where(I >= jj, area + areac[ab + M], area)
+
+    # /* find intersection o of p0p1 and p2p3 */
+    A1 = (p1[0] - p0[0]) * (p2[1] - p0[1]) - (p2[0] - p0[0]) * (p1[1] - p0[1])
+    A2 = (p1[0] - p0[0]) * (p3[1] - p0[1]) - (p3[0] - p0[0]) * (p1[1] - p0[1])
+    A3 = (p2[0] - p0[0]) * (p3[1] - p0[1]) - (p3[0] - p0[0]) * (p2[1] - p0[1])
+    A4 = A1 + A3 - A2
+    t = A3 / (A3 - A4)
+    s = A2 / (A2 - A1)
+    A = A2 * t / 2.0
+    R = area / A  # /* relative area */
+    alpha = 2 - np.sqrt(4 - R / 0.3)  # /* overall alpha for p0-o-p3 curve */
+    c0 = (p0[0] + t * alpha * (p1[0] - p0[0]), p0[1] + t * alpha * (p1[1] - p0[1]))
+    c1 = (p3[0] + s * alpha * (p2[0] - p3[0]), p3[1] + s * alpha * (p2[1] - p3[1]))
+
+    good = (A2 != A1) & (A != 0.0) & ~np.isnan(alpha)
+    sel, B, M, I, J, jj, gk, gi, t, s, alpha = (
+        a[good] for a in (sel, B, M, I, J, jj, gk, gi, t, s, alpha)
+    )
+    p0, p3, c0, c1 = (
+        (a[0][good][:, None], a[1][good][:, None]) for a in (p0, p3, c0, c1)
+    )
+
+    # /* check tangency with edges */
+    kv = gk[:, :-1]  # i+1..j-1
+    tt, x, y = _opti_tangents(p0, c0, c1, p3, (evx[kv], evy[kv]))
+    d = elen[kv]
+    x2 = x - V[kv, 0]
+    y2 = y - V[kv, 1]
+    d1 = (evx[kv] * y2 - x2 * evy[kv]) / d
+    nx = gk[:, 1:]
+    bad = (tt < -0.5) | (d == 0.0) | (np.fabs(d1) > opttolerance)
+    bad |= evx[kv] * x2 + evy[kv] * y2 < 0
+    bad |= (V[kv, 0] - V[nx, 0]) * (x - V[nx, 0]) + (V[kv, 1] - V[nx, 1]) * (
+        y - V[nx, 1]
+    ) < 0
+    pen1 = d1 * d1
+
+    # /* check corners */
+    kc = np.concatenate([gi[:, None], kv], axis=1)  # i..j-1
+    tt, x, y = _opti_tangents(p0, c0, c1, p3, (ecx[kc], ecy[kc]))
+    d = clen[kc]
+    d1 = (ecx[kc] * (y - Cp[kc, 1]) - (x - Cp[kc, 0]) * ecy[kc]) / d
+    d2 = d2tab[kc]
+    d1 = np.where(d2 < 0, -d1, d1)
+    d2 = np.where(d2 < 0, -d2, d2)
+    bad2 = (tt < -0.5) | (d == 0.0) | (d1 < d2 - opttolerance)
+    pen2 = np.where(d1 < d2, (d1 - d2) * (d1 - d2), 0.0)
+
+    good = ~(bad.any(axis=1) | bad2.any(axis=1))
+    pen = np.cumsum(np.concatenate([pen1, pen2], axis=1), axis=1)[:, -1]
+    ok[sel[good]] = True
+    Pg = P[sel[good]]
+    for q, j, i, o in zip(
+        Pg.tolist(),
+        J[good].tolist(),
+        I[good].tolist(),
+        zip(
+            pen[good].tolist(),
+            c0[0][good, 0].tolist(),
+            c0[1][good, 0].tolist(),
+            c1[0][good, 0].tolist(),
+            c1[1][good, 0].tolist(),
+            alpha[good].tolist(),
+            t[good].tolist(),
+            s[good].tolist(),
+        ),
+    ):
+        found.setdefault((q, j), []).append((i,) + o)
+    return ok
+
+
+def _opti_select(pp: _Path, q: int, found: dict) -> None:
+    """
+    choose the best sequence of the possible merges of path q and
+    build its optimized curve
+    """
+    m = pp._curve.n
+    pt = [0] * (m + 1)  # /* pt[m+1] */
+    pen = [0.0] * (m + 1)  # /* pen[m+1] */
+    length = [0] * (m + 1)  # /* len[m+1] */
+    opt = [None] * (m + 1)  # /* opt[m+1] */
+
+    pt[0] = -1
+    pen[0] = 0
+    length[0] = 0
+
+    # /* Fixme: we always start from a fixed point
+    # -- should find the best curve cyclically */
+
+    for j in range(1, m + 1):
+        # /* calculate best path from 0 to j */
+        pt[j] = j - 1
+        pen[j] = pen[j - 1]
+        length[j] = length[j - 1] + 1
+        for o in found.get((q, j), ()):
+            i = o[0]
+            if length[j] > length[i] + 1 or (
+                length[j] == length[i] + 1 and pen[j] > pen[i] + o[1]
+            ):
+                opt[j] = o
+                pt[j] = i
+                pen[j] = pen[i] + o[1]
+                length[j] = length[i] + 1
+    om = length[m]
+    segments = pp._curve.segments
+    osegments = [None] * om
+    s = [None] * om
+    t = [None] * om
+
+    j = m
+    for i in range(om - 1, -1, -1):
+        src = segments[j % m]
+        seg = _Segment()
+        if pt[j] == j - 1:
+            seg.tag = src.tag
+            seg.c = src.c[:]
+            seg.vertex = src.vertex
+            seg.alpha = src.alpha
+            seg.alpha0 = src.alpha0
+            seg.beta = src.beta
+            s[i] = t[i] = 1.0
+        else:
+            _, _, c0x, c0y, c1x, c1y, alpha, ot, os_ = opt[j]
+            seg.tag = POTRACE_CURVETO
+            seg.c = [_Point(c0x, c0y), _Point(c1x, c1y), src.c[2]]
+            seg.vertex = interval(os_, src.c[2], src.vertex)
+            seg.alpha = alpha
+            seg.alpha0 = alpha
+            s[i] = os_
+            t[i] = ot
+        osegments[i] = seg
+        j = pt[j]
+
+    # /* calculate beta parameters */
+    for i in range(om):
+        i1 = mod(i + 1, om)
+        osegments[i].beta = s[i] / (s[i] + t[i1])
+    pp._ocurve = _Curve(0)
+    pp._ocurve.segments = osegments
+    pp._ocurve.alphacurve = True
+
+
 # /* ---------------------------------------------------------------------- */
 
 
+def _chunk_paths(plist: list, nchunks: int) -> list:
+    """
+    Split the indices of plist into about nchunks chunks of similar total
+    path length, biggest paths first: the long outlines get started right
+    away and the small specks even out the load at the end.
+    """
+    order = sorted(range(len(plist)), key=lambda i: len(plist[i]), reverse=True)
+    target = sum(len(p) for p in plist) / nchunks
+    chunks = []
+    chunk = []
+    size = 0
+    for i in order:
+        chunk.append(i)
+        size += len(plist[i])
+        if size >= target:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _process_chunk(
+    plist: list, alphamax, opticurve, opttolerance, budget=None
+) -> Tuple[list, bool]:
+    """
+    process_path in a worker process; returns the processed paths and
+    whether budget, the worker's own copy, ran out. The paths of a chunk
+    started after that are not sent back, but None, for the caller to
+    degrade.
+    """
+    if _out_of_budget(budget):
+        return None, True
+    process_path(
+        plist,
+        alphamax=alphamax,
+        opticurve=opticurve,
+        opttolerance=opttolerance,
+        budget=budget,
+    )
+    return plist, budget is not None and budget.exhausted
+
+
 def process_path(
     plist: list,
     alphamax=1.0,
     opticurve=True,
     opttolerance=0.2,
+    workers: Optional[int] = None,
+    observer=None,
+    budget: Optional[TraceBudget] = None,
+) -> int:
+    """/* return 0 on success, 1 on error with errno set. */
+
+    The paths are independent of each other. With workers > 1 they are
+    distributed over a process pool (see _pool_size) and the processed
+    copies replace the entries of plist, which keeps its order.
+
+    Each stage is reported to observer under the name of its function
+    (the whole pool as "process_path"), and every path once it is done.
+
+    Once budget runs out, the paths not processed yet are degraded to
+    polygons instead (see _degrade_paths). The workers stop on their own
+    in time for their results to be used, and no pool is started once
+    the budget has run out.
+    """
+    points = 0 if budget is None else sum(len(p) for p in plist)
+    workers = _pool_size(workers)
+    if workers > 1 and len(plist) > 1 and not _out_of_budget(budget, points):
+        todo = _observe(
+            observer,
+            "process_path",
+            _process_pool,
+            plist,
+            alphamax,
+            opticurve,
+            opttolerance,
+            workers,
+            budget,
+        )
+        _degrade_paths([plist[i] for i in sorted(todo)])
+        for i, p in enumerate(plist):
+            if observer is not None and i not in todo:
+                observer.path(len(p), p._m, p._fcurve.n)
+        return 0
+
+    # /* call downstream function with each path */
+    _process_batch(plist, alphamax, opticurve, opttolerance, observer, budget)
+    return 0
+
+
+def process_polygons(
+    plist: list,
+    adjust: bool = False,
+    observer=None,
+    budget: Optional[TraceBudget] = None,
 ) -> int:
-    """/* return 0 on success, 1 on error with errno set. */"""
+    """
+    process_path without the curve stages: the paths get their optimal
+    polygons (_bestpolygon) and, with adjust, the vertices adjusted to
+    the outline (_adjust_vertices), but are neither smoothed nor
+    optimized. See polygons_to_numpy for the result. The stages are
+    reported as in process_path. Paths the budget leaves unprocessed get
+    the corners of their outline (see _polygon_vertices).
+    """
+    until = "_adjust_vertices" if adjust else "_bestpolygon"
+    _process_batch(plist, None, False, None, observer, budget, until)
+    return 0
+
+
+def polygons_to_numpy(plist: list, adjust: bool = False) -> tuple:
+    """
+    The polygons of paths processed by process_polygons in one columnar
+    buffer: (points, offsets, parent). The vertices of polygon i are
+    points[offsets[i]:offsets[i+1]], int32 lattice points, or with adjust
+    the float64 adjusted vertices. parent[i] is the index of the polygon
+    that polygon i lies directly inside of, or -1. Holes run opposite to
+    the outlines around them, so a polygon and its children are the
+    rings a triangulation of the shape expects.
+    """
+    vertices = _adjusted_vertices if adjust else _polygon_vertices
+    polygons = [vertices(p) for p in plist]
+    offsets = np.zeros(len(plist) + 1, dtype=np.intp)
+    np.cumsum([len(v) for v in polygons], out=offsets[1:])
+    if polygons:
+        points = np.concatenate(polygons)
+    else:
+        points = np.empty((0, 2), dtype=float if adjust else np.int32)
+
+    pathlist_to_tree(plist)
+    index = {id(p): i for i, p in enumerate(plist)}
+    parent = np.full(len(plist), -1, dtype=np.intp)
+    for i, p in enumerate(plist):
+        for child in p.childlist:
+            parent[index[id(child)]] = i
+    return points, offsets, parent
+
+
+POOL_POLL = 0.1  # /* seconds between checks of the budget while waiting for the pool */
+
+
+def _process_pool(
+    plist: list, alphamax, opticurve, opttolerance, workers, budget=None
+) -> set:
+    """
+    process_path with a pool of workers processes; returns the indices of
+    the paths left unprocessed because budget ran out.
+
+    Each worker gets a copy of budget whose deadline leaves twice the time
+    this process keeps to degrade all paths (see _out_of_budget), so that
+    the workers send back what they have before it gives up on them, and
+    are not still at it while it degrades the rest. Chunks that are done
+    by then are used even if an earlier one is not.
+    """
+    points = 0
+    shared = budget
+    if budget is not None:
+        points = sum(len(p) for p in plist)
+        if budget.deadline is not None:
+            shared = copy.copy(budget)
+            shared.deadline -= 2 * points * budget._per_point
+    pool = ProcessPoolExecutor(max_workers=workers)
+    todo = set()
+    expired = False
+    try:
+        jobs = [
+            (
+                chunk,
+                pool.submit(
+                    _process_chunk,
+                    [plist[i] for i in chunk],
+                    alphamax,
+                    opticurve,
+                    opttolerance,
+                    shared,
+                ),
+            )
+            for chunk in _chunk_paths(plist, 4 * workers)
+        ]
+        for chunk, job in jobs:
+            while budget is not None and not expired and not job.done():
+                wait([job], timeout=POOL_POLL)
+                expired = not job.done() and _out_of_budget(budget, points)
+            if expired and not job.done():
+                todo.update(chunk)
+                continue
+            done, exhausted = job.result()
+            if exhausted:
+                budget.exhausted = True
+            if done is None:
+                todo.update(chunk)
+                continue
+            for i, p in zip(chunk, done):
+                plist[i] = p
+    finally:
+        # /* don't wait for the chunks started before the budget ran out */
+        pool.shutdown(wait=not expired, cancel_futures=expired)
+    return todo
+
+
+def _process_one(
+    p: _Path, alphamax, opticurve, opttolerance, observer=None, budget=None
+) -> None:
+    """run the tracing pipeline on a single path"""
+    _process_batch([p], alphamax, opticurve, opttolerance, observer, budget)
+
+
+PROCESS_BATCH = 1024  # /* paths whose vertices are adjusted and smoothed together */
+BUDGET_BATCH = 128  # /* PROCESS_BATCH under a budget, so that less work is lost */
+OPTI_BATCH = 64  # /* fewer curve segments are optimized one path at a time */
+
+
+def _process_batch(
+    plist: list,
+    alphamax,
+    opticurve,
+    opttolerance,
+    observer=None,
+    budget=None,
+    until: Optional[str] = None,
+) -> None:
+    """
+    run the tracing pipeline on the paths of plist; the vertex stages
+    (_adjust_vertices, _smooth) handle PROCESS_BATCH paths at a time.
+    budget is checked before every stage, and between the paths of the
+    per-path stages, keeping time to degrade them all. When it runs out,
+    the paths of the batch at hand are degraded along with the rest,
+    even those that got through some stages, so batches are only
+    BUDGET_BATCH paths long under a budget. With until set to "_bestpolygon" or
+    "_adjust_vertices", the pipeline ends after that stage and the paths
+    get no final curve.
+    """
 
     def TRY(x):
         if x:
             raise ValueError
 
-    # /* call downstream function with each path */
+    points = 0 if budget is None else sum(len(p) for p in plist)
+    size = PROCESS_BATCH if budget is None else BUDGET_BATCH
+
+    def stage(name, function, *args):
+        if _out_of_budget(budget, points):
+            raise _OutOfBudget
+        return _observe(observer, name, function, *args)
+
+    for b in range(0, len(plist), size):
+        batch = plist[b : b + size]
+        try:
+            TRY(stage("_calc_sums", _each, _calc_sums, batch, budget, points))
+            TRY(stage("_calc_lon", _each, _calc_lon, batch, budget, points))
+            TRY(stage("_bestpolygon", _each, _bestpolygon, batch, budget, points))
+            if until != "_bestpolygon":
+                TRY(stage("_adjust_vertices", _adjust_vertices_batch, batch))
+            if until is None:
+                stage("_smooth", _smooth_paths, batch, alphamax)
+                if opticurve:
+                    TRY(stage("_opticurve", _opticurve_paths, batch, opttolerance))
+        except _OutOfBudget:
+            _degrade_paths(plist[b:])
+            return
+        for p in batch:
+            if until is None:
+                p._fcurve = p._ocurve if opticurve else p._curve
+            if observer is not None:
+                observer.path(len(p), p._m, len(p._fcurve))
+
+
+class _OutOfBudget(Exception):
+    """raised to abandon the stages of a batch once the budget runs out"""
+
+
+def _each(
+    stage, plist: list, budget: Optional[TraceBudget] = None, points: int = 0
+) -> int:
+    """
+    run a per-path stage on every path of plist; 1 if it failed on one.
+    points is passed on to _out_of_budget.
+    """
+    for p in plist:
+        if _out_of_budget(budget, points):
+            raise _OutOfBudget
+        if stage(p):
+            return 1
+    return 0
+
+
+def _polygon_vertices(p: _Path) -> np.ndarray:
+    """
+    The optimal polygon of a path as an int32 (m, 2) array of its points,
+    or if _bestpolygon has not got to it, the corners of its outline, the
+    points where its direction changes. Negative paths are reversed, as
+    _smooth_paths does, so that holes run opposite to their outlines.
+    """
+    pt = p.pt
+    if p._po:
+        v = pt[np.asarray(p._po)]
+    else:
+        step = np.diff(pt, axis=0, append=pt[:1])
+        v = pt[(step != np.roll(step, 1, axis=0)).any(axis=1)]
+    return v if p.sign else v[::-1]
+
+
+def _adjusted_vertices(p: _Path) -> np.ndarray:
+    """
+    The vertices _adjust_vertices gave a path as a float64 (m, 2) array,
+    oriented as in _polygon_vertices, which it falls back to for a path
+    the budget left unprocessed.
+    """
+    if p.degraded or not p._curve:
+        return _polygon_vertices(p).astype(float)
+    v = np.array([(s.vertex.x, s.vertex.y) for s in p._curve], dtype=float)
+    return v if p.sign else v[::-1]
+
+
+def _degrade_paths(plist: list) -> None:
+    """
+    Give the paths the budget left unprocessed a polygon of corners as
+    their final curve, see _polygon_vertices. As this runs once the time
+    is up, the corners of all outlines are found in one pass over their
+    concatenated points, and each segment is made with only the points a
+    corner uses, its vertex (also c[0] and c[1]) and its end c[2].
+    """
+    if not plist:
+        return
+    outline = [p for p in plist if not p._po]
+    if outline:
+        pt = np.concatenate([p.pt for p in outline])
+        n = np.array([len(p) for p in outline])
+        end = np.cumsum(n)
+        start = end - n
+        i = np.arange(len(pt))
+        nxt = i + 1
+        nxt[end - 1] = start
+        step = pt[nxt] - pt
+        prv = i - 1
+        prv[start] = end - 1
+        corner = (step != step[prv]).any(axis=1)
+        counts = np.add.reduceat(corner, start)
+        corners = np.split(pt[corner], np.cumsum(counts)[:-1])
+        corners = dict(zip(map(id, outline), corners))
+    v = []
+    for p in plist:
+        pv = p.pt[np.asarray(p._po)] if p._po else corners[id(p)]
+        v.append(pv if p.sign else pv[::-1])
+    n = np.array([len(pv) for pv in v])
+    v = np.concatenate(v)
+    end = np.cumsum(n)
+    nxt = np.arange(1, len(v) + 1)
+    nxt[end - 1] = end - n
+    ends = ((v + v[nxt]) / 2).tolist()
+    v = v.tolist()
+    new = _Segment.__new__
+    for p, b, e in zip(plist, (end - n).tolist(), end.tolist()):
+        curve = _Curve(0)
+        segments = curve.segments
+        for (x, y), (ex, ey) in zip(v[b:e], ends[b:e]):
+            s = new(_Segment)
+            s.tag = POTRACE_CORNER
+            s.vertex = vertex = _Point(x, y)
+            s.c = [vertex, vertex, _Point(ex, ey)]
+            s.alpha = s.alpha0 = s.beta = 0.0
+            segments.append(s)
+        p._fcurve = curve
+        p.degraded = True
+
+
+def _smooth_paths(plist: list, alphamax: float) -> None:
+    """reverse the negative paths of plist and smooth all their curves"""
     for p in plist:
-        TRY(_calc_sums(p))
-        TRY(_calc_lon(p))
-        TRY(_bestpolygon(p))
-        TRY(_adjust_vertices(p))
         if not p.sign:  # /* reverse orientation of negative paths */
             reverse(p._curve)
-        _smooth(p._curve, alphamax)
-        if opticurve:
-            TRY(_opticurve(p, opttolerance))
-            p._fcurve = p._ocurve
-        else:
-            p._fcurve = p._curve
-    return 0
+    _smooth_batch([p._curve for p in plist], alphamax)
+
+
+def _opticurve_paths(plist: list, opttolerance: float) -> int:
+    """_opticurve for the paths of plist, batched if there are enough segments"""
+    if sum(p._curve.n for p in plist) >= OPTI_BATCH:
+        return _opticurve_batch(plist, opttolerance)
+    return _each(lambda p: _opticurve(p, opttolerance), plist)
+
+
+def _observe(observer, name: str, function, *args, **kwargs):
+    """
+    function(*args, **kwargs), reported to observer as the stage name
+    with its wall time
+    """
+    if observer is None:
+        return function(*args, **kwargs)
+    observer.stage_start(name)
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        observer.stage_end(name, time.perf_counter() - start)
+
+
+def _release(p: _Path) -> None:
+    """drop the intermediate data of a processed path, keeping pt and the final curve"""
+    p._sums = None
+    p._lon = []
+    p._po = []
+    if p._fcurve is not p._curve:
+        p._curve = []
+    if p._fcurve is not p._ocurve:
+        p._ocurve = []
+
+
+# /* seconds per point kept by a pool worker for sending back the paths
+#    of a level and building its Path again, see _trace_level */
+TRANSFER_PER_POINT = 1e-5
+
+
+def _trace_level(bitmap: Bitmap, params: dict) -> list:
+    """
+    Bitmap.trace in a worker process. Returns the processed paths without
+    their tree links, which would pickle recursively, or the data only
+    the stages need (see _release), and the partial flag; the caller
+    builds the Path again. A budget keeps time for that on top of its
+    reserve, going by TRANSFER_PER_POINT.
+    """
+    budget = params.get("budget")
+    if budget is not None:
+        budget._per_point += TRANSFER_PER_POINT
+    result = bitmap.trace(**params)
+    plist = [curve._path for curve in result]
+    for p in plist:
+        _release(p)
+        p.next = None
+        p.sibling = None
+        p.childlist = []
+    return plist, result.partial
+
+
+def trace_levels(bitmaps: list, workers: Optional[int] = None, **params) -> list:
+    """
+    Trace the bitmaps of several black levels (see Bitmap.levels) with the
+    same parameters, returning one Path per level. With workers > 1 the
+    levels are traced in a pool of that many processes, at most one per
+    CPU (see _pool_size).
+
+    A budget is split between the levels, or with workers between the
+    rounds of levels traced at once, so that every level gets its part
+    of the time (see _split_budget) and the last ones are not left empty.
+    In a pool, every worker checks its own copy of its part, on a CPU of
+    its own: the deadline holds, but cancel() does not reach them.
+    budget is flagged exhausted if any level is partial.
+    """
+    budget = _as_budget(params.pop("budget", None))
+    workers = _pool_size(workers)
+    parallel = workers > 1 and len(bitmaps) > 1
+    width = workers if parallel else 1
+    parts = _split_budget(budget, -(-len(bitmaps) // width))
+    levels = [
+        (bm, dict(params, budget=parts[k // width])) for k, bm in enumerate(bitmaps)
+    ]
+    if parallel:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = [pool.submit(_trace_level, bm, kw) for bm, kw in levels]
+            results = [Path(*job.result()) for job in jobs]
+    else:
+        results = [bm.trace(**kw) for bm, kw in levels]
+    if budget is not None and any(r.partial for r in results):
+        budget.exhausted = True
+    return results
 
 
 # END TRACE SECTION.
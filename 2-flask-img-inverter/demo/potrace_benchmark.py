@@ -0,0 +1,341 @@
+"""
+Benchmark for potrace.
+
+By default only the path decomposition stage (bm_to_pathlist) is timed:
+each of the bundled texture images is decomposed, optionally tiled into
+a larger mosaic to raise the number of paths, and the decomposition time
+is reported next to the number of paths found. Run from the
+``2-flask-img-inverter`` directory:
+
+    python -m demo.potrace_benchmark --scale 1 2 4
+
+With --stages, every stage of Bitmap.trace is timed separately on all
+bundled images (and on synthetic images of the sizes given with
+--synthetic), and the number of paths, points and curve segments and the
+peak memory of each stage are reported. The results can be saved with
+--json and compared against an earlier run with --compare:
+
+    python -m demo.potrace_benchmark --stages --synthetic 1024 --json new.json
+    python -m demo.potrace_benchmark --stages --compare new.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from .potrace import (
+    PROCESS_BATCH,
+    Bitmap,
+    POTRACE_TURNPOLICY_MINORITY,
+    _PackedBitmap,
+    _RunBitmap,
+    _adjust_vertices_batch,
+    _bestpolygon,
+    _calc_lon,
+    _calc_sums,
+    _each,
+    _opticurve_paths,
+    _smooth_paths,
+    bm_to_pathlist,
+    bm_to_pathlist_tiled,
+    use_jit,
+)
+
+IMG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "img")
+
+
+def load_bitmap(path, scale=1, blacklevel=0.5):
+    """Threshold an image and tile it scale x scale times."""
+    data = Bitmap(Image.open(path), blacklevel=blacklevel).data
+    if scale > 1:
+        data = np.tile(data, (scale, scale))
+    return data
+
+
+def synthetic_bitmap(size, seed=0):
+    """
+    A size x size bitmap of random blobs: coarse noise, smoothly
+    upsampled and thresholded at half.
+    """
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, (size // 16 + 2, size // 16 + 2), dtype=np.uint8)
+    image = Image.fromarray(noise).resize((size, size), Image.BICUBIC)
+    return np.asarray(image) < 128
+
+
+def time_decomposition(
+    data,
+    turdsize=2,
+    turnpolicy=POTRACE_TURNPOLICY_MINORITY,
+    backend="dense",
+    tilesize=None,
+):
+    if tilesize is not None:
+        start = time.perf_counter()
+        plist = bm_to_pathlist_tiled(
+            data, tilesize=tilesize, turdsize=turdsize, turnpolicy=turnpolicy
+        )
+        return len(plist), time.perf_counter() - start
+    if backend == "packed":
+        bm = _PackedBitmap.frombool(data)
+    elif backend == "rle":
+        bm = _RunBitmap.frombool(data)
+    else:
+        bm = np.pad(data, [(0, 1), (0, 1)], mode="constant")
+    start = time.perf_counter()
+    plist = bm_to_pathlist(bm, turdsize=turdsize, turnpolicy=turnpolicy)
+    return len(plist), time.perf_counter() - start
+
+
+STAGES = (
+    "bm_to_pathlist",
+    "_calc_sums",
+    "_calc_lon",
+    "_bestpolygon",
+    "_adjust_vertices",
+    "_smooth",
+    "_opticurve",
+)
+# column headers for STAGES
+LABELS = ("decompose", "sums", "lon", "polygon", "vertices", "smooth", "opticurve")
+MIN_COMPARE_TIME = 0.005  # seconds; faster stages are too noisy to compare
+
+
+def trace_stages(
+    data,
+    turdsize=2,
+    turnpolicy=POTRACE_TURNPOLICY_MINORITY,
+    alphamax=1.0,
+    opticurve=True,
+    opttolerance=0.2,
+):
+    """
+    The stages of Bitmap.trace on data, as a list of (name, function)
+    pairs in the order of STAGES, and the list of paths they fill in.
+    The functions must be called in order; each runs its stage on all
+    paths, PROCESS_BATCH paths at a time like process_path.
+    """
+    bm = np.pad(data, [(0, 1), (0, 1)], mode="constant")
+    plist = []
+
+    def batches():
+        for b in range(0, len(plist), PROCESS_BATCH):
+            yield plist[b : b + PROCESS_BATCH]
+
+    def check(x):
+        if x:
+            raise ValueError
+
+    def decompose():
+        plist[:] = bm_to_pathlist(bm, turdsize=turdsize, turnpolicy=turnpolicy)
+
+    def per_path(stage):
+        def run():
+            check(_each(stage, plist))
+
+        return run
+
+    def adjust_vertices():
+        for batch in batches():
+            check(_adjust_vertices_batch(batch))
+
+    def smooth():
+        for batch in batches():
+            _smooth_paths(batch, alphamax)
+
+    def optimize():
+        for batch in batches():
+            if opticurve:
+                check(_opticurve_paths(batch, opttolerance))
+            for p in batch:
+                p._fcurve = p._ocurve if opticurve else p._curve
+
+    functions = (
+        decompose,
+        per_path(_calc_sums),
+        per_path(_calc_lon),
+        per_path(_bestpolygon),
+        adjust_vertices,
+        smooth,
+        optimize,
+    )
+    return list(zip(STAGES, functions)), plist
+
+
+def measure_stages(data, repeat=1, **params):
+    """
+    Run trace_stages(data, **params) repeat times and once more under
+    tracemalloc. Returns the best wall time and the peak of traced
+    memory of every stage, in seconds and bytes, and the sizes of the
+    result.
+    """
+    times = {name: float("inf") for name in STAGES}
+    for _ in range(repeat):
+        stages, plist = trace_stages(data, **params)
+        for name, function in stages:
+            start = time.perf_counter()
+            function()
+            times[name] = min(times[name], time.perf_counter() - start)
+
+    peaks = {}
+    stages, plist = trace_stages(data, **params)
+    tracemalloc.start()
+    try:
+        for name, function in stages:
+            tracemalloc.reset_peak()
+            function()
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "paths": len(plist),
+        "points": sum(len(p) for p in plist),
+        "polygon_vertices": sum(p._m for p in plist),
+        "curve_segments": sum(p._fcurve.n for p in plist),
+        "stages": {
+            name: {"time": times[name], "peak_bytes": peaks[name]} for name in STAGES
+        },
+        "time": sum(times.values()),
+        "peak_bytes": max(peaks.values()),
+    }
+
+
+def run_stages(args):
+    inputs = [(path, scale) for path in args.images for scale in args.scale]
+    inputs += [("synthetic-%d" % size, 1) for size in args.synthetic]
+    params = dict(
+        turdsize=args.turdsize, opticurve=not args.no_opticurve, opttolerance=0.2
+    )
+
+    header = f"{'image':<24} {'scale':>5} {'paths':>7} {'points':>9}"
+    header += "".join(f" {label:>10}" for label in LABELS)
+    print(header + f" {'total [s]':>10} {'peak [MB]':>10}")
+    results = []
+    for name, scale in inputs:
+        if name.startswith("synthetic-"):
+            data = synthetic_bitmap(int(name.split("-")[1]))
+        else:
+            data = load_bitmap(name, scale)
+        result = measure_stages(data, repeat=args.repeat, **params)
+        result.update(image=os.path.basename(name), scale=scale, shape=data.shape)
+        results.append(result)
+        row = f"{result['image']:<24} {scale:>5}"
+        row += f" {result['paths']:>7} {result['points']:>9}"
+        row += "".join(f" {result['stages'][n]['time']:>10.3f}" for n in STAGES)
+        print(row + f" {result['time']:>10.3f} {result['peak_bytes'] / 2**20:>10.1f}")
+
+    report = {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": params,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(report, fp, indent=1)
+    if args.compare:
+        with open(args.compare) as fp:
+            return compare(json.load(fp), report, args.threshold)
+    return 0
+
+
+def compare(old, new, threshold):
+    """
+    Print the time of every stage in new relative to old, for the images
+    present in both; return 1 if any stage that took at least
+    MIN_COMPARE_TIME before is more than threshold times slower, else 0.
+    """
+    before = {(r["image"], r["scale"]): r for r in old["results"]}
+    regressed = False
+    print()
+    print(f"{'image':<24} {'scale':>5}" + "".join(f" {label:>10}" for label in LABELS))
+    for r in new["results"]:
+        o = before.get((r["image"], r["scale"]))
+        if o is None:
+            continue
+        row = f"{r['image']:<24} {r['scale']:>5}"
+        for name in STAGES:
+            t0 = o["stages"][name]["time"]
+            ratio = r["stages"][name]["time"] / t0 if t0 else 1.0
+            slower = ratio > threshold and t0 >= MIN_COMPARE_TIME
+            mark = "!" if slower else " "
+            regressed |= slower
+            row += f" {ratio:>9.2f}{mark}"
+        print(row)
+    return 1 if regressed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--scale", type=int, nargs="+", default=None)
+    parser.add_argument("--turdsize", type=int, default=2)
+    parser.add_argument(
+        "--backend", choices=["dense", "packed", "rle"], default="dense"
+    )
+    parser.add_argument("--tilesize", type=int, default=None)
+    parser.add_argument(
+        "--stages", action="store_true", help="time every stage of Bitmap.trace"
+    )
+    parser.add_argument("--synthetic", type=int, nargs="*", default=[], metavar="SIZE")
+    parser.add_argument("--no-opticurve", action="store_true")
+    parser.add_argument(
+        "--jit", action="store_true", help="use the compiled kernels (needs numba)"
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", help="save the --stages results to this file")
+    parser.add_argument("--compare", help="--stages results of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="slowdown relative to --compare reported as a regression",
+    )
+    args = parser.parse_args()
+    if args.jit and not use_jit():
+        parser.error("--jit needs numba")
+
+    if args.stages:
+        if not args.images:
+            args.images = sorted(
+                glob.glob(os.path.join(IMG_DIR, "*.png"))
+                + glob.glob(os.path.join(IMG_DIR, "*.jpg"))
+            )
+        args.scale = args.scale or [1]
+        sys.exit(run_stages(args))
+
+    args.images = args.images or sorted(
+        glob.glob(os.path.join(IMG_DIR, "texture_*.png"))
+    )
+    args.scale = args.scale or [1, 2, 4]
+
+    print(f"{'image':<20} {'scale':>5} {'pixels':>10} {'paths':>7} {'time [s]':>9} {'us/path':>8}")
+    for path in args.images:
+        for scale in args.scale:
+            data = load_bitmap(path, scale)
+            n, elapsed = time_decomposition(
+                data,
+                turdsize=args.turdsize,
+                backend=args.backend,
+                tilesize=args.tilesize,
+            )
+            per_path = 1e6 * elapsed / n if n else 0.0
+            print(
+                f"{os.path.basename(path):<20} {scale:>5} {data.size:>10} "
+                f"{n:>7} {elapsed:>9.3f} {per_path:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+"""
+Compiled kernels for the scalar inner loops of potrace.
+
+findpath, _calc_lon and _bestpolygon walk their paths point by point and
+do not vectorize. This module has array versions of them that numba
+compiles to machine code when it is installed; potrace uses them after
+use_jit() has been called. Without numba the kernels are plain Python
+functions, which is slower than the originals but lets check_parity
+compare them everywhere. Run
+
+    python -m demo.potrace_jit
+
+from the ``2-flask-img-inverter`` directory to compile the kernels and
+check that they give the same paths as the pure Python code.
+"""
+
+import glob
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from .potrace import (
+    POTRACE_TURNPOLICY_BLACK,
+    POTRACE_TURNPOLICY_MAJORITY,
+    POTRACE_TURNPOLICY_MINORITY,
+    POTRACE_TURNPOLICY_RANDOM,
+    POTRACE_TURNPOLICY_RIGHT,
+    POTRACE_TURNPOLICY_WHITE,
+    detrand_t,
+)
+
+AVAILABLE = numba is not None
+
+
+def _jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+_DETRAND = np.array(detrand_t, dtype=np.int64)
+_NO_J = 1 << 62  # /* stands for an unbounded j in calc_lon */
+
+
+@_jit
+def _item(bm, y, x):
+    """bm.item(y, x), with 0 for the pixels out of range"""
+    h, w = bm.shape
+    if -h <= y < h and -w <= x < w:
+        return bm[y % h, x % w]
+    return False
+
+
+@_jit
+def _detrand(x, y):
+    z = ((0x04B3E375 * x) ^ y) * 0x05A8EF93
+    return (
+        _DETRAND[z & 0xFF]
+        ^ _DETRAND[(z >> 8) & 0xFF]
+        ^ _DETRAND[(z >> 16) & 0xFF]
+        ^ _DETRAND[(z >> 24) & 0xFF]
+    )
+
+
+@_jit
+def _vote(bm, y, x):
+    """1 for a black pixel, -1 for a white one or one out of range"""
+    h, w = bm.shape
+    return 1 if 0 <= y < h and 0 <= x < w and bm[y, x] else -1
+
+
+@_jit
+def _majority(bm, x, y):
+    for i in range(2, 5):  # /* check at "radius" i */
+        ct = 0
+        for a in range(-i + 1, i - 2):
+            ct += _vote(bm, y + i - 1, x + a)
+            ct += _vote(bm, y + a - 1, x + i - 1)
+            ct += _vote(bm, y - i, x + a - 1)
+            ct += _vote(bm, y + a, x - i)
+        if ct > 0:
+            return 1
+        elif ct < 0:
+            return 0
+    return 0
+
+
+@_jit
+def findpath(bm, x0, y0, sign, turnpolicy):
+    """
+    potrace.findpath on a dense bitmap: returns the points of the path
+    as an int32 array and its area
+    """
+    x = x0
+    y = y0
+    dirx = 0
+    diry = -1
+    pt = np.empty((256, 2), dtype=np.int32)
+    n = 0
+    area = 0
+
+    while True:
+        if n == pt.shape[0]:
+            buf = np.empty((2 * n, 2), dtype=np.int32)
+            buf[:n] = pt
+            pt = buf
+        pt[n, 0] = x
+        pt[n, 1] = y
+        n += 1
+
+        x += dirx
+        y += diry
+        area += x * diry
+
+        if x == x0 and y == y0:
+            break
+
+        c = _item(bm, y + (diry - dirx - 1) // 2, x + (dirx + diry - 1) // 2)
+        d = _item(bm, y + (diry + dirx - 1) // 2, x + (dirx - diry - 1) // 2)
+
+        if c and not d:  # /* ambiguous turn */
+            if (
+                turnpolicy == POTRACE_TURNPOLICY_RIGHT
+                or (turnpolicy == POTRACE_TURNPOLICY_BLACK and sign)
+                or (turnpolicy == POTRACE_TURNPOLICY_WHITE and not sign)
+                or (turnpolicy == POTRACE_TURNPOLICY_RANDOM and _detrand(x, y))
+                or (turnpolicy == POTRACE_TURNPOLICY_MAJORITY and _majority(bm, x, y))
+                or (
+                    turnpolicy == POTRACE_TURNPOLICY_MINORITY
+                    and not _majority(bm, x, y)
+                )
+            ):
+                tmp = dirx  # /* right turn */
+                dirx = diry
+                diry = -tmp
+            else:
+                tmp = dirx  # /* left turn */
+                dirx = -diry
+                diry = tmp
+        elif c:  # /* right turn */
+            tmp = dirx
+            dirx = diry
+            diry = -tmp
+        elif not d:  # /* left turn */
+            tmp = dirx
+            dirx = -diry
+            diry = tmp
+
+    return pt[:n].copy(), area
+
+
+@_jit
+def _sign(x):
+    if x > 0:
+        return 1
+    if x < 0:
+        return -1
+    return 0
+
+
+@_jit
+def _cyclic(a, b, c):
+    if a <= c:
+        return a <= b < c
+    return a <= b or b < c
+
+
+@_jit
+def calc_lon(pt):
+    """potrace._calc_lon on the points of a path: returns lon as an array"""
+    xs = pt[:, 0].astype(np.int64)
+    ys = pt[:, 1].astype(np.int64)
+    n = len(xs)
+    ct = np.zeros(4, dtype=np.int64)
+    pivk = np.zeros(n, dtype=np.int64)
+    nc = np.zeros(n, dtype=np.int64)
+    lon = np.zeros(n, dtype=np.int64)
+
+    k = 0
+    for i in range(n - 1, -1, -1):
+        if xs[i] != xs[k] and ys[i] != ys[k]:
+            k = i + 1
+        nc[i] = k
+
+    for i in range(n - 1, -1, -1):
+        ct[:] = 0
+        i1 = (i + 1) % n
+        ct[(3 + 3 * (xs[i1] - xs[i]) + (ys[i1] - ys[i])) // 2] += 1
+
+        c0x = 0
+        c0y = 0
+        c1x = 0
+        c1y = 0
+
+        k = nc[i]
+        k1 = i
+        found = False
+        while True:
+            ct[(3 + 3 * _sign(xs[k] - xs[k1]) + _sign(ys[k] - ys[k1])) // 2] += 1
+
+            # /* if all four "directions" have occurred, cut this path */
+            if ct[0] and ct[1] and ct[2] and ct[3]:
+                pivk[i] = k1
+                found = True
+                break
+
+            cur_x = xs[k] - xs[i]
+            cur_y = ys[k] - ys[i]
+
+            # /* see if current constraint is violated */
+            if c0x * cur_y - c0y * cur_x < 0 or c1x * cur_y - c1y * cur_x > 0:
+                break
+
+            # /* else, update constraint */
+            if abs(cur_x) > 1 or abs(cur_y) > 1:
+                off_x = cur_x + (1 if (cur_y >= 0 and (cur_y > 0 or cur_x < 0)) else -1)
+                off_y = cur_y + (1 if (cur_x <= 0 and (cur_x < 0 or cur_y < 0)) else -1)
+                if c0x * off_y - c0y * off_x >= 0:
+                    c0x = off_x
+                    c0y = off_y
+                off_x = cur_x + (1 if (cur_y <= 0 and (cur_y < 0 or cur_x < 0)) else -1)
+                off_y = cur_y + (1 if (cur_x >= 0 and (cur_x > 0 or cur_y < 0)) else -1)
+                if c1x * off_y - c1y * off_x <= 0:
+                    c1x = off_x
+                    c1y = off_y
+            k1 = k
+            k = nc[k1]
+            if not _cyclic(k, i, k1):
+                break
+        if found:
+            continue
+
+        # /* constraint_viol: find the last point along k1..k which
+        # satisfied the constraint */
+        dk_x = _sign(xs[k] - xs[k1])
+        dk_y = _sign(ys[k] - ys[k1])
+        cur_x = xs[k1] - xs[i]
+        cur_y = ys[k1] - ys[i]
+        a = c0x * cur_y - c0y * cur_x
+        b = c0x * dk_y - c0y * dk_x
+        c = c1x * cur_y - c1y * cur_x
+        d = c1x * dk_y - c1y * dk_x
+        j = _NO_J
+        if b < 0:
+            j = a // -b
+        if d > 0:
+            j = min(j, -c // d)
+        pivk[i] = (k1 + j) % n
+
+    # /* clean up: for each i, let lon[i] be the largest k such that for
+    # all i' with i<=i'<k, i'<k<=pivk[i']. */
+    j = pivk[n - 1]
+    lon[n - 1] = j
+    for i in range(n - 2, -1, -1):
+        if _cyclic(i + 1, pivk[i], j):
+            j = pivk[i]
+        lon[i] = j
+
+    i = n - 1
+    while _cyclic((i + 1) % n, j, lon[i]):
+        lon[i] = j
+        i -= 1
+    return lon
+
+
+@_jit
+def _penalty3(pt, sums, x0, y0, i, j):
+    """potrace.penalty3, with the same floating point operations"""
+    n = len(pt)
+    r = 0
+    if j >= n:
+        j -= n
+        r = 1
+    if r == 0:
+        x = sums[j + 1, 0] - sums[i, 0]
+        y = sums[j + 1, 1] - sums[i, 1]
+        x2 = sums[j + 1, 2] - sums[i, 2]
+        xy = sums[j + 1, 3] - sums[i, 3]
+        y2 = sums[j + 1, 4] - sums[i, 4]
+        k = j + 1 - i
+    else:
+        x = sums[j + 1, 0] - sums[i, 0] + sums[n, 0]
+        y = sums[j + 1, 1] - sums[i, 1] + sums[n, 1]
+        x2 = sums[j + 1, 2] - sums[i, 2] + sums[n, 2]
+        xy = sums[j + 1, 3] - sums[i, 3] + sums[n, 3]
+        y2 = sums[j + 1, 4] - sums[i, 4] + sums[n, 4]
+        k = j + 1 - i + n
+
+    xi = np.int64(pt[i, 0])
+    yi = np.int64(pt[i, 1])
+    xj = np.int64(pt[j, 0])
+    yj = np.int64(pt[j, 1])
+    px = (xi + xj) / 2.0 - x0
+    py = (yi + yj) / 2.0 - y0
+    ey = xj - xi
+    ex = -(yj - yi)
+
+    a = (x2 - 2 * x * px) / k + px * px
+    b = (xy - x * py - y * px) / k + px * py
+    c = (y2 - 2 * y * py) / k + py * py
+
+    s = ex * ex * a + 2 * ex * ey * b + ey * ey * c
+    return math.sqrt(s)
+
+
+@_jit
+def bestpolygon(pt, lon, sums, x0, y0):
+    """
+    potrace._bestpolygon on the points, lon and sums of a path: returns
+    the vertices of the optimal polygon as an array
+    """
+    n = len(pt)
+    pen = np.zeros(n + 1)
+    prev = np.zeros(n + 1, dtype=np.int64)
+    clip0 = np.zeros(n, dtype=np.int64)
+    clip1 = np.zeros(n + 1, dtype=np.int64)
+    seg0 = np.zeros(n + 1, dtype=np.int64)
+    seg1 = np.zeros(n + 1, dtype=np.int64)
+
+    # /* calculate clipped paths */
+    for i in range(n):
+        c = (lon[(i - 1) % n] - 1) % n
+        if c == i:
+            c = (i + 1) % n
+        if c < i:
+            clip0[i] = n
+        else:
+            clip0[i] = c
+
+    # /* calculate backwards path clipping, non-cyclic */
+    j = 1
+    for i in range(n):
+        while j <= clip0[i]:
+            clip1[j] = i
+            j += 1
+
+    # /* calculate seg0[j] = longest path from 0 with j segments */
+    i = 0
+    j = 0
+    while i < n:
+        seg0[j] = i
+        i = clip0[i]
+        j += 1
+    seg0[j] = n
+    m = j
+
+    # /* calculate seg1[j] = longest path to n with m-j segments */
+    i = n
+    for j in range(m, 0, -1):
+        seg1[j] = i
+        i = clip1[i]
+    seg1[0] = 0
+
+    # /* now find the shortest path with m segments, based on penalty3 */
+    pen[0] = 0
+    for j in range(1, m + 1):
+        for i in range(seg1[j], seg0[j] + 1):
+            best = -1.0
+            for k in range(seg0[j - 1], clip1[i] - 1, -1):
+                thispen = _penalty3(pt, sums, x0, y0, k, i) + pen[k]
+                if best < 0 or thispen < best:
+                    prev[i] = k
+                    best = thispen
+            pen[i] = best
+
+    # /* read off shortest path */
+    po = np.zeros(m, dtype=np.int64)
+    i = n
+    j = m - 1
+    while i > 0:
+        i = prev[i]
+        po[j] = i
+        j -= 1
+    return po
+
+
+def warm_up() -> float:
+    """
+    compile the kernels by running them on a small bitmap, so that the
+    first trace does not pay for it; returns the seconds this took
+    """
+    from .potrace import _calc_sums, _Path
+
+    start = time.perf_counter()
+    bm = np.zeros((9, 9), dtype=bool)
+    bm[2:6, 2:5] = True
+    bm[3, 3] = False
+    for turnpolicy in range(7):
+        pt, area = findpath(bm, 2, 6, True, turnpolicy)
+        p = _Path(pt, int(area), True)
+        _calc_sums(p)
+        bestpolygon(pt, calc_lon(pt), p._sums, p._x0, p._y0)
+    return time.perf_counter() - start
+
+
+def check_parity(bitmaps=None, turnpolicies=range(7)) -> list:
+    """
+    Decompose each bitmap with every turn policy and process its paths,
+    once with the kernels and once with the pure Python code, and
+    compare the points, area, lon and polygon of all paths. bitmaps are
+    bool arrays; by default the bundled images and some random noise.
+    Returns a description of every difference found.
+    """
+    from . import potrace
+    from .potrace_benchmark import IMG_DIR, load_bitmap
+
+    if bitmaps is None:
+        images = sorted(
+            glob.glob(os.path.join(IMG_DIR, "*.png"))
+            + glob.glob(os.path.join(IMG_DIR, "*.jpg"))
+        )
+        bitmaps = [load_bitmap(path) for path in images]
+        rng = np.random.default_rng(0)
+        bitmaps += [rng.random((40, 60)) < density for density in (0.1, 0.5, 0.9)]
+
+    def run(data, turnpolicy):
+        bm = np.pad(data, [(0, 1), (0, 1)], mode="constant")
+        plist = potrace.bm_to_pathlist(bm, turnpolicy=turnpolicy)
+        for p in plist:
+            potrace._calc_sums(p)
+            potrace._calc_lon(p)
+            potrace._bestpolygon(p)
+        return [(p.pt.tolist(), p.area, p.sign, list(p._lon), p._po) for p in plist]
+
+    enabled = potrace._jit
+    differences = []
+    try:
+        for index, data in enumerate(bitmaps):
+            for turnpolicy in turnpolicies:
+                potrace._jit = None
+                expected = run(data, turnpolicy)
+                potrace._jit = sys.modules[__name__]
+                got = run(data, turnpolicy)
+                if got != expected:
+                    differences.append(
+                        "bitmap %d, turnpolicy %d: %d paths, expected %d%s"
+                        % (
+                            index,
+                            turnpolicy,
+                            len(got),
+                            len(expected),
+                            _first_difference(got, expected),
+                        )
+                    )
+    finally:
+        potrace._jit = enabled
+    return differences
+
+
+def _first_difference(got, expected) -> str:
+    fields = ("points", "area", "sign", "lon", "polygon")
+    for q, (a, b) in enumerate(zip(got, expected)):
+        for field, x, y in zip(fields, a, b):
+            if x != y:
+                return "; path %d differs in its %s" % (q, field)
+    return ""
+
+
+if __name__ == "__main__":
+    if not AVAILABLE:
+        print("numba is not installed: checking the kernels as plain Python")
+    print("warm-up: %.2f s" % warm_up())
+    differences = check_parity()
+    for difference in differences:
+        print(difference)
+    print("%d differences" % len(differences))
+    raise SystemExit(1 if differences else 0)
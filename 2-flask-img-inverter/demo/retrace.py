@@ -0,0 +1,99 @@
+"""
+Incremental re-tracing of successive versions of one image.
+
+Editing tools post the whole image again after every tweak, although
+usually only a small part of it changed. A Retracer remembers the paths
+of the previous version: the new bitmap is decomposed again, and only
+the paths that differ from the previous ones go through process_path,
+the expensive part of tracing. The others reuse their finished curves.
+
+The decomposition itself is not skipped outside the changed area: the
+turn policies resolve ambiguous turns on the partially xor-ed bitmap,
+so a path can depend on paths traced before it nearby, and only a full
+decomposition reproduces the result of Bitmap.trace exactly.
+"""
+
+import threading
+
+import numpy as np
+
+from .potrace import (
+    POTRACE_TURNPOLICY_MINORITY,
+    Bitmap,
+    Path,
+    _as_budget,
+    _release,
+    bm_to_pathlist,
+    process_path,
+)
+
+
+class Retracer:
+    def __init__(self):
+        self._data = None
+        self._params = None
+        self._paths = {}  # /* (sign, points) -> processed path */
+        self._lock = threading.Lock()
+        self.changed = 0  # /* paths processed by the last trace */
+
+    def trace(
+        self,
+        bitmap: Bitmap,
+        turdsize: int = 2,
+        turnpolicy: int = POTRACE_TURNPOLICY_MINORITY,
+        alphamax=1.0,
+        opticurve=True,
+        opttolerance=0.2,
+        observer=None,
+        budget=None,
+    ) -> Path:
+        """
+        Bitmap.trace, reusing the curves of paths unchanged since the last
+        call; observer only hears of the paths that are processed again.
+        If budget runs out, only the curves that were finished are kept
+        for the next call, which traces the bitmap again in any case.
+        """
+        budget = _as_budget(budget)
+        params = (turdsize, turnpolicy, alphamax, opticurve, opttolerance)
+        with self._lock:
+            if params != self._params:
+                self._paths = {}
+            elif self._data is not None and np.array_equal(self._data, bitmap.data):
+                self.changed = 0
+                return Path(list(self._paths.values()))
+
+            plist = bm_to_pathlist(
+                bitmap._padded("dense"),
+                turdsize=turdsize,
+                turnpolicy=turnpolicy,
+                observer=observer,
+                budget=budget,
+            )
+            todo = []
+            for i, p in enumerate(plist):
+                old = self._paths.get(_path_key(p))
+                if old is not None:
+                    plist[i] = old
+                else:
+                    todo.append(p)
+            process_path(
+                todo,
+                alphamax=alphamax,
+                opticurve=opticurve,
+                opttolerance=opttolerance,
+                observer=observer,
+                budget=budget,
+            )
+            for p in todo:
+                _release(p)
+
+            partial = budget is not None and budget.exhausted
+            self.changed = len(todo)
+            self._data = None if partial else bitmap.data.copy()
+            self._params = params
+            self._paths = {_path_key(p): p for p in plist if not p.degraded}
+            return Path(plist, partial=partial)
+
+
+def _path_key(p) -> tuple:
+    return p.sign, p.pt.tobytes()
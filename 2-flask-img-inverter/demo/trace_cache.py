@@ -0,0 +1,154 @@
+"""
+Content-addressed cache of trace results.
+
+A result is keyed by a digest of the thresholded bitmap and the trace
+parameters, and stored in columnar form (see path_to_arrays), so it can
+be rendered again without tracing. Recent results are kept in memory;
+with a directory, every result is also written there as an .npz file,
+and the least recently used files are removed once the directory grows
+beyond max_disk_bytes.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .potrace import Bitmap, Path
+
+ARRAYS = ("tags", "c", "offsets", "parent")
+
+
+def path_to_arrays(plist: Path) -> dict:
+    """
+    The curves of a traced Path as arrays: tags, c and offsets as returned
+    by Path.to_numpy, and parent, the index of the curve each curve lies
+    directly inside of, or -1 for the top-level curves.
+    """
+    tags, c, offsets = plist.to_numpy()
+    index = {id(curve): i for i, curve in enumerate(plist)}
+    parent = np.full(len(plist), -1, dtype=np.intp)
+    for i, curve in enumerate(plist):
+        for child in curve.children:
+            parent[index[id(child)]] = i
+    return {"tags": tags, "c": c, "offsets": offsets, "parent": parent}
+
+
+class TraceCache:
+    """
+    In-memory LRU of up to max_entries results in front of an optional
+    directory of .npz files capped at max_disk_bytes. Safe to share
+    between the threads of a server.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_entries: int = 32,
+        max_disk_bytes: int = 256 << 20,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(bitmap: Bitmap, **params) -> str:
+        """digest of the bitmap's pixels and the given trace parameters"""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(np.asarray(bitmap.data.shape, dtype=np.int64).tobytes())
+        h.update(np.packbits(bitmap.data).tobytes())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                return result
+        if self.directory is None:
+            return None
+        filename = self._filename(key)
+        try:
+            with np.load(filename) as npz:
+                result = {name: npz[name] for name in ARRAYS}
+            os.utime(filename)  # mark as recently used for eviction
+        except (OSError, KeyError, ValueError):
+            return None
+        self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: dict) -> None:
+        self._remember(key, result)
+        if self.directory is None:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fp:
+            np.savez(fp, **{name: result[name] for name in ARRAYS})
+        os.replace(tmp, self._filename(key))
+        self._evict_disk()
+
+    def trace(
+        self, bitmap: Bitmap, tracer=None, observer=None, budget=None, **params
+    ) -> dict:
+        """
+        path_to_arrays(bitmap.trace(**params)), from the cache if possible;
+        on a miss, tracer(bitmap, **params) is called instead of
+        bitmap.trace if given. observer and budget are passed on to the
+        trace, and so only matter on a miss. A partial result (see
+        Bitmap.trace) is not cached, and has "partial" set to True.
+        """
+        key = self.key(bitmap, **params)
+        result = self.get(key)
+        if result is None:
+            if observer is not None:
+                params = dict(params, observer=observer)
+            if budget is not None:
+                params = dict(params, budget=budget)
+            if tracer is None:
+                plist = bitmap.trace(**params)
+            else:
+                plist = tracer(bitmap, **params)
+            result = path_to_arrays(plist)
+            if plist.partial:
+                result["partial"] = True
+            else:
+                self.put(key, result)
+        return result
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npz")
+
+    def _remember(self, key: str, result: dict) -> None:
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,112 @@
+"""
+Observing traces.
+
+Bitmap.trace, bm_to_pathlist and process_path accept an observer, which
+is told when each stage of the trace starts and ends and, for every
+finished path, how many points, polygon vertices and curve segments it
+has. TraceObserver documents the interface; TraceStats adds the reports
+up, so that a server can log where the time of a trace went (many small
+paths or one huge outline) and export the totals as metrics.
+"""
+
+import threading
+
+
+class TraceObserver:
+    """
+    The methods an observer is called with. They do nothing; subclasses
+    override the ones they need.
+    """
+
+    def stage_start(self, name: str) -> None:
+        """the stage name (e.g. "bm_to_pathlist", "_calc_lon") starts"""
+
+    def stage_end(self, name: str, seconds: float) -> None:
+        """the stage name ended after seconds of wall time"""
+
+    def path(self, points: int, polygon: int, segments: int) -> None:
+        """
+        a path is finished: points on its outline, vertices of its
+        optimal polygon and segments of its final curve
+        """
+
+
+class TraceStats(TraceObserver):
+    """
+    Totals of the reports of one or more traces: the number of calls and
+    the time of every stage, and the number and sizes of the paths.
+    Safe to share between threads, so one instance can also collect the
+    metrics of all requests of a server (see merge).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}  # name -> [calls, seconds]
+        self.paths = 0
+        self.points = 0
+        self.max_points = 0
+        self.polygon = 0
+        self.max_polygon = 0
+        self.segments = 0
+        self.max_segments = 0
+
+    def stage_end(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+
+    def path(self, points: int, polygon: int, segments: int) -> None:
+        with self._lock:
+            self.paths += 1
+            self.points += points
+            self.max_points = max(self.max_points, points)
+            self.polygon += polygon
+            self.max_polygon = max(self.max_polygon, polygon)
+            self.segments += segments
+            self.max_segments = max(self.max_segments, segments)
+
+    def merge(self, other: "TraceStats") -> None:
+        """add the totals of other to these"""
+        other = other.as_dict()
+        with self._lock:
+            for name, stage in other["stages"].items():
+                mine = self.stages.setdefault(name, [0, 0.0])
+                mine[0] += stage["calls"]
+                mine[1] += stage["seconds"]
+            self.paths += other["paths"]
+            self.points += other["points"]
+            self.max_points = max(self.max_points, other["max_points"])
+            self.polygon += other["polygon"]
+            self.max_polygon = max(self.max_polygon, other["max_polygon"])
+            self.segments += other["segments"]
+            self.max_segments = max(self.max_segments, other["max_segments"])
+
+    def as_dict(self) -> dict:
+        """the totals as plain values, e.g. to be served as JSON"""
+        with self._lock:
+            return {
+                "paths": self.paths,
+                "points": self.points,
+                "max_points": self.max_points,
+                "polygon": self.polygon,
+                "max_polygon": self.max_polygon,
+                "segments": self.segments,
+                "max_segments": self.max_segments,
+                "stages": {
+                    name: {"calls": calls, "seconds": seconds}
+                    for name, (calls, seconds) in self.stages.items()
+                },
+            }
+
+    def __str__(self):
+        d = self.as_dict()
+        text = (
+            f"{d['paths']} paths, {d['points']} points (largest {d['max_points']}), "
+            f"{d['polygon']} polygon vertices (largest {d['max_polygon']}), "
+            f"{d['segments']} segments (largest {d['max_segments']})"
+        )
+        stages = ", ".join(
+            f"{name} {stage['seconds']:.3f}s" for name, stage in d["stages"].items()
+        )
+        return f"{text}; {stages}" if stages else text
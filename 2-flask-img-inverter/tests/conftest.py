@@ -0,0 +1,31 @@
+import pathlib
+
+import pytest
+from PIL import Image
+
+from demo import potrace
+
+IMAGES = sorted((pathlib.Path(__file__).parent.parent / "img").iterdir())
+
+
+@pytest.fixture(autouse=True)
+def pure_python():
+    """run the pure Python stages, not the potrace_jit kernels"""
+    jit = potrace._jit
+    potrace.use_jit(False)
+    yield
+    potrace._jit = jit
+
+
+def decompose(image) -> list:
+    """the paths of a sample image with the stages up to _calc_lon done"""
+    bm = potrace.Bitmap(Image.open(image))
+    plist = potrace.bm_to_pathlist(
+        bm._padded("dense"),
+        turdsize=2,
+        turnpolicy=potrace.POTRACE_TURNPOLICY_MINORITY,
+    )
+    for p in plist:
+        potrace._calc_sums(p)
+        potrace._calc_lon(p)
+    return plist
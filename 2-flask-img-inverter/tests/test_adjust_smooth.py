@@ -0,0 +1,141 @@
+import copy
+import math
+
+import pytest
+
+from demo import potrace
+from demo.potrace import (
+    POTRACE_CORNER,
+    POTRACE_CURVETO,
+    _adjust_vertex,
+    _Curve,
+    _Point,
+    ddenom,
+    dpara,
+    interval,
+    mod,
+    pointslope,
+    sq,
+)
+
+from .conftest import IMAGES, decompose
+
+
+def adjust_vertices_scalar(pp) -> list:
+    """
+    The adjusted vertices of the optimal polygon of pp, one vertex at a
+    time: the quadratic forms of the two segments at a vertex are added
+    and minimized on its unit square by _adjust_vertex.
+    """
+    m = pp._m
+    po = pp._po
+    n = len(pp)
+    ctr = [_Point() for i in range(m)]
+    dir = [_Point() for i in range(m)]
+    q = []
+    for i in range(m):
+        j = po[mod(i + 1, m)]
+        j = mod(j - po[i], n) + po[i]
+        pointslope(pp, po[i], j, ctr[i], dir[i])
+    for i in range(m):
+        d = sq(dir[i].x) + sq(dir[i].y)
+        if d == 0.0:
+            q.append([[0] * 3 for _ in range(3)])
+        else:
+            v = [dir[i].y, -dir[i].x, 0.0]
+            v[2] = -v[1] * ctr[i].y - v[0] * ctr[i].x
+            q.append([[v[l] * v[k] / d for k in range(3)] for l in range(3)])
+
+    vertices = []
+    for i in range(m):
+        j = mod(i - 1, m)
+        Q = [[q[j][l][k] + q[i][l][k] for k in range(3)] for l in range(3)]
+        sx = pp.pt.item(po[i], 0) - pp._x0
+        sy = pp.pt.item(po[i], 1) - pp._y0
+        x, y = _adjust_vertex(Q, sx, sy)
+        vertices.append((x + pp._x0, y + pp._y0))
+    return vertices
+
+
+def smooth_scalar(curve: _Curve, alphamax: float) -> None:
+    """_smooth, one vertex at a time"""
+    m = curve.n
+    for i in range(m):
+        j = mod(i + 1, m)
+        k = mod(i + 2, m)
+        p4 = interval(1 / 2.0, curve[k].vertex, curve[j].vertex)
+
+        denom = ddenom(curve[i].vertex, curve[k].vertex)
+        if denom != 0.0:
+            dd = dpara(curve[i].vertex, curve[j].vertex, curve[k].vertex) / denom
+            dd = math.fabs(dd)
+            alpha = (1 - 1.0 / dd) if dd > 1 else 0
+            alpha = alpha / 0.75
+        else:
+            alpha = 4 / 3.0
+        curve[j].alpha0 = alpha
+
+        if alpha >= alphamax:
+            curve[j].tag = POTRACE_CORNER
+            curve[j].c[1] = curve[j].vertex
+            curve[j].c[2] = p4
+        else:
+            if alpha < 0.55:
+                alpha = 0.55
+            elif alpha > 1:
+                alpha = 1
+            curve[j].tag = POTRACE_CURVETO
+            curve[j].c[0] = interval(0.5 + 0.5 * alpha, curve[i].vertex, curve[j].vertex)
+            curve[j].c[1] = interval(0.5 + 0.5 * alpha, curve[k].vertex, curve[j].vertex)
+            curve[j].c[2] = p4
+        curve[j].alpha = alpha
+        curve[j].beta = 0.5
+    curve.alphacurve = True
+
+
+def segment(s) -> tuple:
+    """what _smooth sets on a segment, as plain values"""
+    if s.tag == POTRACE_CORNER:
+        c = s.c[1:]
+    else:
+        c = s.c
+    return (
+        s.tag,
+        (s.vertex.x, s.vertex.y),
+        [(p.x, p.y) for p in c],
+        s.alpha,
+        s.alpha0,
+        s.beta,
+    )
+
+
+def polygons(image) -> list:
+    plist = decompose(image)
+    for p in plist:
+        potrace._bestpolygon(p)
+    return plist
+
+
+@pytest.mark.parametrize("image", IMAGES, ids=lambda image: image.name)
+def test_adjust_vertices_batch_matches_adjust_vertex(image):
+    plist = polygons(image)
+    assert potrace._adjust_vertices_batch(plist) == 0
+    for p in plist:
+        vertices = [(s.vertex.x, s.vertex.y) for s in p._curve.segments]
+        assert vertices == adjust_vertices_scalar(p)
+
+
+@pytest.mark.parametrize("alphamax", [1.0, 0.5])
+@pytest.mark.parametrize("image", IMAGES, ids=lambda image: image.name)
+def test_smooth_batch_matches_scalar(image, alphamax):
+    plist = polygons(image)
+    potrace._adjust_vertices_batch(plist)
+    expected = [copy.deepcopy(p._curve) for p in plist]
+    for curve in expected:
+        smooth_scalar(curve, alphamax)
+    potrace._smooth_batch([p._curve for p in plist], alphamax)
+    for p, curve in zip(plist, expected):
+        assert p._curve.alphacurve
+        assert [segment(s) for s in p._curve.segments] == [
+            segment(s) for s in curve.segments
+        ]
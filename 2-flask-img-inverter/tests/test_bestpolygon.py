@@ -0,0 +1,83 @@
+import pytest
+
+from demo import potrace
+from demo.potrace import mod, penalty3
+
+from .conftest import IMAGES, decompose
+
+
+def bestpolygon_scalar(pp) -> list:
+    """
+    The optimal polygon of pp as found by the vertex by vertex search of
+    potrace, with one penalty3 call per candidate edge.
+    """
+    n = len(pp)
+    pen = [None] * (n + 1)
+    prev = [None] * (n + 1)
+    clip0 = [None] * n
+    clip1 = [None] * (n + 1)
+    seg0 = [None] * (n + 1)
+    seg1 = [None] * (n + 1)
+
+    for i in range(n):
+        c = mod(pp._lon[mod(i - 1, n)] - 1, n)
+        if c == i:
+            c = mod(i + 1, n)
+        clip0[i] = n if c < i else c
+
+    j = 1
+    for i in range(n):
+        while j <= clip0[i]:
+            clip1[j] = i
+            j += 1
+
+    i = 0
+    j = 0
+    while i < n:
+        seg0[j] = i
+        i = clip0[i]
+        j += 1
+    seg0[j] = n
+    m = j
+
+    i = n
+    for j in range(m, 0, -1):
+        seg1[j] = i
+        i = clip1[i]
+    seg1[0] = 0
+
+    pen[0] = 0
+    for j in range(1, m + 1):
+        for i in range(seg1[j], seg0[j] + 1):
+            best = -1
+            for k in range(seg0[j - 1], clip1[i] - 1, -1):
+                thispen = penalty3(pp, k, i) + pen[k]
+                if best < 0 or thispen < best:
+                    prev[i] = k
+                    best = thispen
+            pen[i] = best
+
+    po = [None] * m
+    i = n
+    j = m - 1
+    while i > 0:
+        i = prev[i]
+        po[j] = i
+        j -= 1
+    return po
+
+
+@pytest.mark.parametrize("image", IMAGES, ids=lambda image: image.name)
+def test_bestpolygon_matches_scalar_penalty3(image):
+    for p in decompose(image):
+        assert potrace._bestpolygon(p) == 0
+        assert p._po == bestpolygon_scalar(p)
+        assert p._m == len(p._po)
+
+
+def test_bestpolygon_chunks(monkeypatch):
+    """candidate edges split over many penalty3_batch calls"""
+    monkeypatch.setattr(potrace, "BESTPOLYGON_CHUNK", 7)
+    for p in decompose(IMAGES[0]):
+        potrace._bestpolygon(p)
+        assert p._po == bestpolygon_scalar(p)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from demo import potrace
+
+from .conftest import IMAGES
+
+pytest.importorskip("numba")
+
+from demo import potrace_jit  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def pure_python():
+    """overrides the conftest fixture: run the potrace_jit kernels"""
+    jit = potrace._jit
+    assert potrace.use_jit(True)
+    yield
+    potrace._jit = jit
+
+
+@pytest.mark.parametrize("turnpolicy", range(7))
+def test_kernels_match_python(turnpolicy):
+    assert potrace_jit.check_parity(turnpolicies=[turnpolicy]) == []
+
+
+@pytest.mark.parametrize("image", IMAGES, ids=lambda image: image.name)
+def test_trace_with_jit_matches_python(image):
+    bm = potrace.Bitmap(Image.open(image))
+    got = bm.trace().to_numpy()
+    potrace.use_jit(False)
+    expected = bm.trace().to_numpy()
+    for a, b in zip(got, expected):
+        np.testing.assert_array_equal(a, b)
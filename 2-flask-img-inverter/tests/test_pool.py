@@ -0,0 +1,14 @@
+import numpy as np
+from PIL import Image
+
+from demo import potrace
+
+from .conftest import IMAGES
+
+
+def test_trace_with_workers_matches_sequential():
+    bm = potrace.Bitmap(Image.open(IMAGES[0]))
+    got = bm.trace(workers=2)
+    assert not got.partial
+    for a, b in zip(got.to_numpy(), bm.trace().to_numpy()):
+        np.testing.assert_array_equal(a, b)